@@ -4,24 +4,70 @@ CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     email VARCHAR UNIQUE,
     name VARCHAR,
-    hashed_password VARCHAR
+    hashed_password VARCHAR,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+-- Databases created before users.created_at existed; `manage.py backfill-user-stats` fills it in.
+-- Added without a default so existing rows stay NULL instead of getting today's date.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;
+ALTER TABLE users ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
 
 CREATE INDEX IF NOT EXISTS ix_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS ix_users_id ON users(id);
 
+-- Per-user order aggregates matching models.UserStats
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    order_count INTEGER NOT NULL DEFAULT 0,
+    total_spent FLOAT NOT NULL DEFAULT 0,
+    first_order_at TIMESTAMP,
+    last_order_at TIMESTAMP
+);
+
 -- Products table matching models.Product
 CREATE TABLE IF NOT EXISTS products (
     id SERIAL PRIMARY KEY,
+    sku VARCHAR,
     name VARCHAR,
     price FLOAT,
     description VARCHAR,
     image VARCHAR,
-    category VARCHAR
+    category VARCHAR,
+    -- Units available to sell; NULL means not tracked
+    stock INTEGER CONSTRAINT ck_products_stock_non_negative CHECK (stock IS NULL OR stock >= 0)
 );
+-- Databases created before bulk imports keyed products on sku.
+ALTER TABLE products ADD COLUMN IF NOT EXISTS sku VARCHAR;
+ALTER TABLE products ADD COLUMN IF NOT EXISTS stock INTEGER CONSTRAINT ck_products_stock_non_negative CHECK (stock IS NULL OR stock >= 0);
 
 CREATE INDEX IF NOT EXISTS ix_products_name ON products(name);
 CREATE INDEX IF NOT EXISTS ix_products_id ON products(id);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_products_sku ON products(sku);
+-- Keyset pagination for GET /products (filter by category, sort by id/price/name)
+CREATE INDEX IF NOT EXISTS ix_products_category_id ON products(category, id);
+CREATE INDEX IF NOT EXISTS ix_products_category_price_id ON products(category, price, id);
+CREATE INDEX IF NOT EXISTS ix_products_category_name_id ON products(category, name, id);
+CREATE INDEX IF NOT EXISTS ix_products_price_id ON products(price, id);
+CREATE INDEX IF NOT EXISTS ix_products_name_id ON products(name, id);
+-- Full-text search for GET /products/search (must match models.product_search_vector)
+CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN ((
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(category, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+));
+
+-- Checkout reservations matching models.StockReservation
+CREATE TABLE IF NOT EXISTS stock_reservations (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    quantity INTEGER NOT NULL,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_id ON stock_reservations(id);
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_user_id_product_id ON stock_reservations(user_id, product_id);
+CREATE INDEX IF NOT EXISTS ix_stock_reservations_product_id_expires_at ON stock_reservations(product_id, expires_at);
 
 -- Orders table matching models.Order
 CREATE TABLE IF NOT EXISTS orders (
@@ -33,6 +79,8 @@ CREATE TABLE IF NOT EXISTS orders (
 );
 
 CREATE INDEX IF NOT EXISTS ix_orders_id ON orders(id);
+CREATE INDEX IF NOT EXISTS ix_orders_user_id_created_at ON orders(user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders(created_at);
 
 -- OrderItems table matching models.OrderItem
 CREATE TABLE IF NOT EXISTS order_items (
@@ -44,14 +92,89 @@ CREATE TABLE IF NOT EXISTS order_items (
 );
 
 CREATE INDEX IF NOT EXISTS ix_order_items_id ON order_items(id);
+CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items(order_id);
+
+-- Daily sales rollups matching models.DailyProductSales and models.DailyCategorySales;
+-- fill them for existing orders with `manage.py rebuild-analytics`.
+CREATE TABLE IF NOT EXISTS daily_product_sales (
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    category VARCHAR,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_daily_product_sales_product_id_day ON daily_product_sales(product_id, day);
+
+CREATE TABLE IF NOT EXISTS daily_category_sales (
+    day DATE NOT NULL,
+    category VARCHAR NOT NULL,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue FLOAT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, category)
+);
+
+CREATE INDEX IF NOT EXISTS ix_daily_category_sales_category_day ON daily_category_sales(category, day);
+
+-- Pending changes to the rollups matching models.SalesDelta, folded in by analytics.fold
+CREATE TABLE IF NOT EXISTS sales_deltas (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders(id),
+    day DATE NOT NULL,
+    -- NULL for the per-category rows
+    product_id INTEGER REFERENCES products(id),
+    category VARCHAR,
+    orders INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    revenue FLOAT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_sales_deltas_order_id ON sales_deltas(order_id);
 
 -- Payments table matching models.Payment
 CREATE TABLE IF NOT EXISTS payments (
     id SERIAL PRIMARY KEY,
     order_id INTEGER REFERENCES orders(id),
+    user_id INTEGER REFERENCES users(id),
     amount FLOAT,
     status VARCHAR,
-    provider VARCHAR DEFAULT 'manual'
+    provider VARCHAR DEFAULT 'manual',
+    idempotency_key VARCHAR,
+    gateway_reference VARCHAR,
+    error VARCHAR,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uq_payments_user_id_idempotency_key UNIQUE (user_id, idempotency_key)
+);
+-- Databases created before idempotent, gateway-backed payments. Timestamps are
+-- added without a default so existing rows stay NULL instead of getting today's date.
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id);
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS gateway_reference VARCHAR;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS error VARCHAR;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS created_at TIMESTAMP;
+ALTER TABLE payments ALTER COLUMN created_at SET DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE payments ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+ALTER TABLE payments ALTER COLUMN updated_at SET DEFAULT CURRENT_TIMESTAMP;
+-- Same name as the table constraint above, so this is a no-op on new databases.
+CREATE UNIQUE INDEX IF NOT EXISTS uq_payments_user_id_idempotency_key ON payments(user_id, idempotency_key);
+
+CREATE INDEX IF NOT EXISTS ix_payments_id ON payments(id);
+CREATE INDEX IF NOT EXISTS ix_payments_order_id ON payments(order_id);
+
+-- Payment outbox matching models.PaymentJob
+CREATE TABLE IF NOT EXISTS payment_jobs (
+    id SERIAL PRIMARY KEY,
+    payment_id INTEGER NOT NULL UNIQUE REFERENCES payments(id),
+    status VARCHAR NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP,
+    last_error VARCHAR
 );
 
-CREATE INDEX IF NOT EXISTS ix_payments_id ON payments(id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS ix_payment_jobs_id ON payment_jobs(id);
+CREATE INDEX IF NOT EXISTS ix_payment_jobs_status_run_at ON payment_jobs(status, run_at);
\ No newline at end of file
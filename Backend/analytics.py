@@ -0,0 +1,239 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select, insert, delete, and_, func, desc
+from sqlalchemy.orm import Session
+import logging
+import os
+import threading
+import database, models
+
+# Sales analytics served from daily rollup tables.
+#
+# daily_product_sales and daily_category_sales hold orders, units and revenue
+# per UTC day, so reports never scan orders and order_items. Checkout doesn't
+# touch them: crud.create_order and crud.cancel_order only append the order's
+# changes to sales_deltas (one row per product and one per category) in their
+# own transaction, which takes no lock that another order needs. fold() moves
+# batches of deltas into the rollups, upserting in key order; a thread in each
+# API process runs it every ANALYTICS_FOLD_INTERVAL seconds, so reports trail
+# new orders by about that long. On PostgreSQL the batches are claimed with
+# SKIP LOCKED, so several processes can fold side by side.
+#
+# Cancelled orders are excluded. Sales count under the category the product had
+# when the order was placed; a cancellation takes them back out of that same
+# category (from the order's pending deltas or daily_product_sales), and
+# rebuild() uses the current one.
+
+DEFAULT_DAYS = 7
+ANALYTICS_SORTS = ("revenue", "units", "orders")
+ANALYTICS_FOLD_INTERVAL = float(os.getenv("ANALYTICS_FOLD_INTERVAL", "5")) # Per process; 0 disables
+ANALYTICS_FOLD_BATCH = int(os.getenv("ANALYTICS_FOLD_BATCH", "5000"))
+
+logger = logging.getLogger("techshop.analytics")
+
+class InvalidQuery(ValueError):
+    pass
+
+def date_range(start: date = None, end: date = None):
+    """Inclusive (start, end), defaulting to the last DEFAULT_DAYS days up to today (UTC)."""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=DEFAULT_DAYS - 1)
+    if start > end:
+        raise InvalidQuery("start must not be after end")
+    return start, end
+
+def _increment(db: Session, model, keys: tuple, rows: list):
+    # rows: dicts with the key columns plus orders/units/revenue deltas
+    database.upsert(db, model, rows, keys, lambda new: {c: getattr(model, c) + new[c] for c in ("orders", "units", "revenue")})
+
+def record_order(db: Session, order_id: int, created_at: datetime, items, sign: int = 1):
+    """Queue an order's sales for the rollups (sign=-1 takes them back out).
+
+    items: (product_id, category, quantity, price) for each order line.
+    Runs in the caller's transaction.
+    """
+    day = created_at.date()
+    products, categories = {}, {}
+    for product_id, category, quantity, price in items:
+        row = products.setdefault(product_id, {"order_id": order_id, "day": day, "product_id": product_id, "category": category, "orders": sign, "units": 0, "revenue": 0.0})
+        row["units"] += sign * quantity
+        row["revenue"] += sign * quantity * price
+        row = categories.setdefault(category or "", {"order_id": order_id, "day": day, "product_id": None, "category": category or "", "orders": sign, "units": 0, "revenue": 0.0})
+        row["units"] += sign * quantity
+        row["revenue"] += sign * quantity * price
+    if products:
+        db.execute(insert(models.SalesDelta), list(products.values()) + list(categories.values()))
+
+def _claim_deltas(db: Session, limit: int) -> list:
+    delta = models.SalesDelta
+    query = select(delta.id).order_by(delta.id).limit(limit)
+    if db.bind.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    return db.execute(query).scalars().all()
+
+def _fold_deltas(db: Session, ids: list) -> int:
+    # Only rows this transaction actually deletes are folded: another process
+    # may have folded some of the claimed ones since they were read (nothing
+    # locks them outside PostgreSQL).
+    delta = models.SalesDelta
+    columns = (delta.day, delta.product_id, delta.category, delta.orders, delta.units, delta.revenue)
+    if db.bind.dialect.name in ("postgresql", "sqlite"):
+        rows = db.execute(delete(delta).where(delta.id.in_(ids)).returning(*columns)).all()
+    else:
+        rows = db.execute(select(*columns).where(delta.id.in_(ids))).all()
+        if db.execute(delete(delta).where(delta.id.in_(ids))).rowcount != len(rows):
+            rows = []
+    if not rows:
+        db.rollback()
+        return 0
+    products, categories = {}, {}
+    for row in rows:
+        if row.product_id is None:
+            totals = categories.setdefault((row.day, row.category), {"day": row.day, "category": row.category, "orders": 0, "units": 0, "revenue": 0.0})
+        else:
+            totals = products.setdefault((row.day, row.product_id), {
+                "day": row.day, "product_id": row.product_id, "category": row.category, "orders": 0, "units": 0, "revenue": 0.0,
+            })
+        totals["orders"] += row.orders
+        totals["units"] += row.units
+        totals["revenue"] += row.revenue
+    _increment(db, models.DailyProductSales, ("day", "product_id"), [products[k] for k in sorted(products)])
+    _increment(db, models.DailyCategorySales, ("day", "category"), [categories[k] for k in sorted(categories)])
+    db.commit()
+    return len(rows)
+
+def fold(db: Session, limit: int = ANALYTICS_FOLD_BATCH) -> int:
+    """Move up to `limit` pending deltas into the rollups and commit; returns how many."""
+    ids = _claim_deltas(db, limit)
+    if not ids:
+        db.rollback()
+        return 0
+    return _fold_deltas(db, ids)
+
+def fold_pending(db: Session) -> int:
+    """Fold deltas until none are left; returns how many."""
+    total = 0
+    while True:
+        folded = fold(db)
+        total += folded
+        if folded < ANALYTICS_FOLD_BATCH:
+            return total
+
+def order_lines(db: Session, order_id: int, day: date):
+    """(product_id, category, quantity, price) of an order's lines, with the
+    category its sales on `day` were counted under."""
+    item, sales, delta = models.OrderItem, models.DailyProductSales, models.SalesDelta
+    pending = select(delta.category).where(delta.order_id == order_id, delta.product_id == item.product_id).limit(1).scalar_subquery()
+    return db.query(item.product_id, func.coalesce(pending, sales.category, models.Product.category), item.quantity, item.price).join(
+        models.Product, models.Product.id == item.product_id
+    ).outerjoin(
+        sales, and_(sales.day == day, sales.product_id == item.product_id)
+    ).filter(item.order_id == order_id).all()
+
+def category_sales(db: Session, start: date = None, end: date = None, category: str = None):
+    """Orders, units and revenue per category per day."""
+    start, end = date_range(start, end)
+    sales = models.DailyCategorySales
+    query = db.query(sales.day, sales.category, sales.orders, sales.units, sales.revenue).filter(sales.day.between(start, end))
+    if category:
+        query = query.filter(sales.category == category)
+    return query.order_by(sales.day, sales.category).all()
+
+def top_products(db: Session, start: date = None, end: date = None, limit: int = 10, category: str = None, sort: str = "revenue"):
+    """Best sellers over the range, by revenue, units or orders."""
+    if sort not in ANALYTICS_SORTS:
+        raise InvalidQuery(f"Unknown sort '{sort}'; expected one of {', '.join(ANALYTICS_SORTS)}")
+    start, end = date_range(start, end)
+    sales = models.DailyProductSales
+    totals = select(
+        sales.product_id,
+        func.sum(sales.orders).label("orders"),
+        func.sum(sales.units).label("units"),
+        func.sum(sales.revenue).label("revenue"),
+    ).where(sales.day.between(start, end))
+    if category:
+        totals = totals.where(sales.category == category)
+    totals = totals.group_by(sales.product_id).order_by(desc(sort), sales.product_id).limit(limit).subquery()
+    return db.query(
+        totals.c.product_id, models.Product.name, models.Product.category, totals.c.orders, totals.c.units, totals.c.revenue
+    ).outerjoin(models.Product, models.Product.id == totals.c.product_id).order_by(
+        desc(totals.c[sort]), totals.c.product_id
+    ).all()
+
+def product_sales(db: Session, product_id: int, start: date = None, end: date = None):
+    """Daily orders, units and revenue of one product."""
+    start, end = date_range(start, end)
+    sales = models.DailyProductSales
+    return db.query(sales.day, sales.orders, sales.units, sales.revenue).filter(
+        sales.product_id == product_id, sales.day.between(start, end)
+    ).order_by(sales.day).all()
+
+def rebuild(db: Session, start: date = None, end: date = None) -> dict:
+    """Recompute the rollups from orders and order_items, for all days or an inclusive range.
+
+    Orders placed inside the range while it runs may be counted twice or not at
+    all, so rebuild past days, or pause order creation for a full rebuild.
+    """
+    order, item, product = models.Order, models.OrderItem, models.Product
+    where = [order.status != "cancelled"]
+    # Pending deltas for the range describe orders counted below.
+    for model in (models.DailyProductSales, models.DailyCategorySales, models.SalesDelta):
+        db.execute(delete(model).where(
+            *([model.day >= start] if start else []), *([model.day <= end] if end else [])
+        ))
+    if start:
+        where.append(order.created_at >= datetime.combine(start, time.min))
+    if end:
+        where.append(order.created_at < datetime.combine(end + timedelta(days=1), time.min))
+
+    lines = select(
+        func.date(order.created_at).label("day"), item.product_id, product.category, item.order_id, item.quantity, item.price
+    ).join(order, order.id == item.order_id).join(product, product.id == item.product_id).where(*where).subquery()
+    db.execute(insert(models.DailyProductSales).from_select(
+        ["day", "product_id", "category", "orders", "units", "revenue"],
+        select(
+            lines.c.day, lines.c.product_id, func.max(lines.c.category),
+            func.count(func.distinct(lines.c.order_id)), func.sum(lines.c.quantity), func.sum(lines.c.quantity * lines.c.price),
+        ).group_by(lines.c.day, lines.c.product_id),
+    ))
+    db.execute(insert(models.DailyCategorySales).from_select(
+        ["day", "category", "orders", "units", "revenue"],
+        select(
+            lines.c.day, func.coalesce(lines.c.category, ""),
+            func.count(func.distinct(lines.c.order_id)), func.sum(lines.c.quantity), func.sum(lines.c.quantity * lines.c.price),
+        ).group_by(lines.c.day, func.coalesce(lines.c.category, "")),
+    ))
+    db.commit()
+    return {
+        "product_days": db.query(func.count()).select_from(models.DailyProductSales).scalar(),
+        "category_days": db.query(func.count()).select_from(models.DailyCategorySales).scalar(),
+    }
+
+# Folding thread
+
+_stop = threading.Event()
+_folder = None
+
+def _fold_loop():
+    while not _stop.wait(ANALYTICS_FOLD_INTERVAL):
+        db = database.SessionLocal()
+        try:
+            fold_pending(db)
+        except Exception:
+            logger.exception("Sales rollup fold failed")
+        finally:
+            db.close()
+
+def start_folding():
+    global _folder
+    if _folder or ANALYTICS_FOLD_INTERVAL <= 0:
+        return
+    _stop.clear()
+    _folder = threading.Thread(target=_fold_loop, name="analytics-fold", daemon=True)
+    _folder.start()
+
+def stop_folding(timeout: float = 10):
+    global _folder
+    _stop.set()
+    if _folder:
+        _folder.join(timeout)
+        _folder = None
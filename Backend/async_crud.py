@@ -0,0 +1,18 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud, models
+
+# Async counterparts of the crud read paths. They execute the same statements
+# as crud, so filtering, ordering and cursors behave identically.
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+async def get_products(db: AsyncSession, skip: int = 0, limit: int = 100, category: str = None, sort: str = "id", cursor: str = None, fields: tuple = None):
+    result = await db.execute(crud.products_statement(skip, limit, category, sort, cursor, fields))
+    return result.all() if fields else result.scalars().all()
+
+async def get_user_orders(db: AsyncSession, user_id: int, limit: int = None, cursor: str = None):
+    result = await db.execute(crud.user_orders_statement(user_id, limit, cursor))
+    return result.scalars().all()
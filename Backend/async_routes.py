@@ -0,0 +1,46 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+import async_crud, auth, crud, responses, schemas
+from cache import catalog_cache
+
+# Async handlers for the read-heavy endpoints, mounted by main.py when
+# DB_ASYNC is enabled. Writes stay on the sync handlers and engine. Reads go
+# to a replica when DATABASE_REPLICA_URLS is set.
+
+router = APIRouter()
+
+@router.get("/auth/me", response_model=schemas.User)
+async def read_user_me_async(current_user: schemas.User = Depends(auth.get_current_user_async)):
+    return current_user
+
+@router.get("/orders/me", response_model=List[schemas.Order])
+async def read_orders_me_async(response: Response, limit: int = 50, cursor: str = None,
+                               current_user: schemas.User = Depends(auth.get_current_user_async),
+                               db: AsyncSession = Depends(auth.get_async_read_db)):
+    try:
+        orders = await async_crud.get_user_orders(db, user_id=current_user.id, limit=limit, cursor=cursor)
+    except crud.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if orders and len(orders) == limit:
+        response.headers["X-Next-Cursor"] = crud.order_cursor(orders[-1])
+    return orders
+
+@router.get("/products", response_model=List[schemas.Product])
+async def read_products_async(request: Request, category: str = None, skip: int = 0, limit: int = 100,
+                              sort: str = "id", cursor: str = None, fields: str = None,
+                              db: AsyncSession = Depends(auth.get_async_read_db)):
+    try:
+        fields = crud.parse_product_fields(fields)
+    except crud.InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    key = (category, skip, limit, sort, cursor, fields)
+    entry = catalog_cache.get(key)
+    if entry is None:
+        version = catalog_cache.version
+        try:
+            products = await async_crud.get_products(db, skip=skip, limit=limit, category=category, sort=sort, cursor=cursor, fields=fields)
+        except crud.InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        entry = responses.cache_product_page(key, products, limit, sort, version, fields)
+    return responses.catalog_response(entry, request.headers.get("if-none-match"), request.headers.get("accept-encoding"))
@@ -1,25 +1,146 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import hmac
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, Response, status
 from sqlalchemy.orm import Session
-import models, database
+import models, schemas, database
+from cache import TTLCache
 
 # SECRET KEY should be in environment variables
 SECRET_KEY = "SECRET_KEY_GOES_HERE" 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Changing BCRYPT_ROUNDS is picked up transparently: hashes with another cost
+# are rehashed on the user's next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt runs in its own process pool so a burst of logins can't hold the GIL
+# or every request thread. At most HASH_WORKERS + HASH_QUEUE_SIZE jobs are
+# admitted; beyond that callers get HashingBusy (a 503) straight away.
+# HASH_WORKERS=0 hashes inline in the calling thread.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", "8"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "5"))
+# Accounts allowed on the /admin endpoints, comma-separated emails.
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
+
+# Verified token payloads and user records, so authenticated requests skip both
+# the signature check and the users lookup on a hit. crud.update_user evicts.
+token_cache = TTLCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")),
+)
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+class HashingBusy(Exception):
+    pass
+
+_hash_pool = None
+_hash_in_flight = 0
+_hash_lock = threading.Lock()
+
+def _run_hash_job(fn, *args):
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    try:
+        return _submit_hash_job(fn, args)
+    except BrokenProcessPool:
+        # A worker died (OOM kill, segfault) and took the pool down with it; the
+        # broken pool has been dropped, so this runs on a fresh one.
+        try:
+            return _submit_hash_job(fn, args)
+        except BrokenProcessPool:
+            raise HashingBusy()
+
+def _submit_hash_job(fn, args):
+    global _hash_pool, _hash_in_flight
+    with _hash_lock:
+        if _hash_in_flight >= HASH_WORKERS + HASH_QUEUE_SIZE:
+            raise HashingBusy()
+        _hash_in_flight += 1
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, initializer=_init_hash_worker)
+        pool = _hash_pool
+    try:
+        future = pool.submit(fn, *args)
+    except Exception as e:
+        _release_hash_slot()
+        if isinstance(e, BrokenProcessPool):
+            _discard_hash_pool(pool)
+        raise
+    # The slot is held until the job is done or cancelled, not until the caller
+    # gives up, so abandoned jobs still count against the bound.
+    future.add_done_callback(_release_hash_slot)
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()  # Only succeeds while it is still queued
+        raise HashingBusy()
+    except BrokenProcessPool:
+        _discard_hash_pool(pool)
+        raise
+
+def _discard_hash_pool(pool):
+    global _hash_pool
+    with _hash_lock:
+        # Another caller may already have replaced it.
+        if _hash_pool is pool:
+            _hash_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _release_hash_slot(future=None):
+    global _hash_in_flight
+    with _hash_lock:
+        _hash_in_flight -= 1
+
+def _init_hash_worker():
+    # Forked workers inherit the server's signal handlers, which would make them
+    # ignore the SIGTERM that stops the server; the parent handles Ctrl-C.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def shutdown_hashing():
+    global _hash_pool
+    with _hash_lock:
+        pool, _hash_pool = _hash_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+def _verify_and_update(plain_password, hashed_password):
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def hashing_stats():
+    return {"workers": HASH_WORKERS, "queue_size": HASH_QUEUE_SIZE, "in_flight": _hash_in_flight, "rounds": BCRYPT_ROUNDS}
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+def verify_and_update_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be replaced."""
+    return _run_hash_job(_verify_and_update, plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return _run_hash_job(_hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -30,3 +151,111 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.set(token, payload)
+    elif payload.get("exp", 0) < time.time():
+        token_cache.pop(token)
+        raise JWTError("Signature has expired.")
+    return payload
+
+def invalidate_user(email: str):
+    user_cache.pop(email)
+
+def _credentials_error():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def token_subject(token: str) -> str:
+    try:
+        email = decode_token(token).get("sub")
+    except JWTError:
+        email = None
+    if email is None:
+        raise _credentials_error()
+    return email
+
+def _cache_user(email: str, db_user: models.User) -> schemas.User:
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user = schemas.User(id=db_user.id, email=db_user.email, name=db_user.name)
+    user_cache.set(email, user)
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> schemas.User:
+    email = token_subject(token)
+    user = user_cache.get(email)
+    if user is None:
+        user = _cache_user(email, db.query(models.User).filter(models.User.email == email).first())
+    return user
+
+def _reader(token: Optional[str]) -> Optional[str]:
+    # Read routing only needs to know who is asking; get_current_user still
+    # rejects bad tokens on authenticated endpoints.
+    if not token:
+        return None
+    try:
+        return token_subject(token)
+    except HTTPException:
+        return None
+
+def _last_write_signature(subject: str, stamp: str) -> str:
+    return hmac.new(SECRET_KEY.encode(), f"{subject}:{stamp}".encode(), hashlib.sha256).hexdigest()
+
+def mark_write(response: Response, subject: str):
+    """Send the client a signed X-Last-Write stamp after it writes.
+
+    Clients send it back on later requests; within READ_YOUR_WRITES_SECONDS
+    their reads then go to the primary, on whichever process serves them.
+    """
+    if database.replicas is None and database.async_replicas is None:
+        return
+    stamp = str(int(time.time() * 1000))
+    response.headers["X-Last-Write"] = f"{stamp}.{_last_write_signature(subject, stamp)}"
+
+def _wrote_recently(subject: Optional[str], last_write: Optional[str]) -> bool:
+    if not (subject and last_write):
+        return False
+    stamp, _, signature = last_write.partition(".")
+    if not stamp.isdigit() or not hmac.compare_digest(signature, _last_write_signature(subject, stamp)):
+        return False
+    return time.time() - int(stamp) / 1000 < database.READ_YOUR_WRITES_SECONDS
+
+def get_read_db(token: Optional[str] = Depends(optional_oauth2_scheme), x_last_write: Optional[str] = Header(None)):
+    """Session for read-only handlers, on a replica when configured (see database.read_session)."""
+    db = database.read_session(_wrote_recently(_reader(token), x_last_write))
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(token: Optional[str] = Depends(optional_oauth2_scheme), x_last_write: Optional[str] = Header(None)):
+    db = await database.async_read_session(_wrote_recently(_reader(token), x_last_write))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def get_current_user_read(token: str = Depends(oauth2_scheme), db: Session = Depends(get_read_db)) -> schemas.User:
+    """get_current_user for read-only handlers, sharing their replica session."""
+    return get_current_user(token, db)
+
+def get_current_admin(current_user: schemas.User = Depends(get_current_user_read)) -> schemas.User:
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db=Depends(get_async_read_db)) -> schemas.User:
+    import async_crud
+
+    email = token_subject(token)
+    user = user_cache.get(email)
+    if user is None:
+        user = _cache_user(email, await async_crud.get_user_by_email(db, email))
+    return user
@@ -0,0 +1,119 @@
+"""Sales analytics: rollup reads against the raw orders/order_items join.
+
+    cd Backend && python -m bench.analytics --orders 200000
+    python -m bench.analytics --orders 5000000 --items-per-order 7 --days 1825   # ~20M order items
+
+Generates --orders orders spread over --days days (1 to --items-per-order lines
+each), rebuilds the rollups, then times the two admin reports for the last
+week, quarter and the whole history: revenue per category per day, and the
+top 10 products by revenue. Each runs once from the rollup tables (the code
+behind /admin/analytics) and once as the ad-hoc join over orders, order_items
+and products. The full-history results of both must match. It also folds one
+order's deltas from two sessions at once (the second claims them, the first
+folds them, then the second folds its stale claim) and checks they are counted
+once. Exits non-zero if any check fails.
+"""
+import argparse
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from bench.common import timed, report
+from bench.datagen import generate
+from sqlalchemy import func, desc
+import analytics, database, models
+
+def raw_category_sales(db, start, end):
+    order, item, product = models.Order, models.OrderItem, models.Product
+    day = func.date(order.created_at)
+    return db.query(
+        day, product.category, func.count(func.distinct(order.id)), func.sum(item.quantity), func.sum(item.quantity * item.price)
+    ).join(order, order.id == item.order_id).join(product, product.id == item.product_id).filter(
+        order.status != "cancelled",
+        order.created_at >= datetime.combine(start, datetime.min.time()),
+        order.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+    ).group_by(day, product.category).order_by(day, product.category).all()
+
+def raw_top_products(db, start, end, limit: int = 10):
+    order, item = models.Order, models.OrderItem
+    revenue = func.sum(item.quantity * item.price)
+    return db.query(item.product_id, revenue).join(order, order.id == item.order_id).filter(
+        order.status != "cancelled",
+        order.created_at >= datetime.combine(start, datetime.min.time()),
+        order.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+    ).group_by(item.product_id).order_by(desc(revenue), item.product_id).limit(limit).all()
+
+def interleaved_folds_count_once(db) -> bool:
+    """Two folds claiming the same deltas add them to the rollups only once."""
+    before = normalized(analytics.category_sales(db, date.min, date.max), 2)
+    order = db.query(models.Order).filter(models.Order.status != "cancelled").first()
+    lines = analytics.order_lines(db, order.id, order.created_at.date())
+    analytics.record_order(db, order.id, order.created_at, lines)
+    db.commit()
+    other = database.SessionLocal()
+    try:
+        claimed = analytics._claim_deltas(other, analytics.ANALYTICS_FOLD_BATCH)
+        analytics.fold_pending(db)
+        analytics._fold_deltas(other, claimed) if claimed else other.rollback()
+    finally:
+        other.close()
+    # Take the order back out; the rollups must be where they started.
+    analytics.record_order(db, order.id, order.created_at, lines, sign=-1)
+    db.commit()
+    analytics.fold_pending(db)
+    return normalized(analytics.category_sales(db, date.min, date.max), 2) == before
+
+def normalized(rows, key_columns: int):
+    # Day as text (SQLite returns strings from date()), revenue to the cent.
+    return [tuple(str(v) for v in row[:key_columns]) + tuple(round(v, 2) for v in row[key_columns:]) for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--items-per-order", type=int, default=5)
+    parser.add_argument("--days", type=int, default=730, help="history the orders are spread over")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.products, args.users, args.orders, items_per_order=args.items_per_order, days=args.days)
+    results = {"config": vars(args), "rows": counts, "generate_seconds": round(time.perf_counter() - started, 1)}
+
+    db = database.SessionLocal()
+    try:
+        started = time.perf_counter()
+        analytics.rebuild(db)
+        results["rebuild_seconds"] = round(time.perf_counter() - started, 2)
+
+        end = datetime.utcnow().date()
+        ranges = {"week": 7, "quarter": 91, "all": args.days + 1}
+        for name, days in ranges.items():
+            start = end - timedelta(days=days - 1)
+            results[name] = {
+                "category_sales": {
+                    "rollup": timed(lambda: analytics.category_sales(db, start, end), args.repeat),
+                    "raw_join": timed(lambda: raw_category_sales(db, start, end), args.repeat),
+                },
+                "top_products": {
+                    "rollup": timed(lambda: analytics.top_products(db, start, end), args.repeat),
+                    "raw_join": timed(lambda: raw_top_products(db, start, end), args.repeat),
+                },
+            }
+
+        start = end - timedelta(days=args.days)
+        top = [(p.product_id, p.revenue) for p in analytics.top_products(db, start, end)]
+        checks = {
+            "category_sales_match": normalized(analytics.category_sales(db, start, end), 2) == normalized(raw_category_sales(db, start, end), 2),
+            "top_products_match": normalized(top, 1) == normalized(raw_top_products(db, start, end), 1),
+            "interleaved_folds_count_once": interleaved_folds_count_once(db),
+        }
+    finally:
+        db.close()
+    results["checks"] = checks
+    report(results)
+    sys.exit(0 if all(checks.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Load benchmark for the main API endpoints, with regression checks.
+
+    cd Backend && python -m bench.api --out results.json
+    python -m bench.api --compare results.json --max-regression 0.15
+
+Generates synthetic data (see bench.datagen), then for each endpoint:
+  * counts SQL statements per request in-process (first call, then warm
+    calls, so cache effects are visible), and
+  * drives a uvicorn subprocess with --concurrency clients for --seconds,
+    reporting throughput and p50/p95/p99 latency.
+
+With --compare, the run exits non-zero when throughput drops or p95 latency
+grows by more than --max-regression, or when warm queries per request grow.
+"""
+import argparse
+import json
+import itertools
+import random
+import sys
+
+from bench.common import serve, request, post_json, post_form, run_load, report
+from bench.datagen import BENCH_PASSWORD, user_email, add_arguments, generate
+
+def http_sender(base_url: str):
+    def send(method: str, path: str, json_body=None, form=None, headers=None):
+        if json_body is not None:
+            return post_json(base_url + path, json_body, headers)[0]
+        if form is not None:
+            return post_form(base_url + path, form)[0]
+        return request(base_url + path, method, headers=headers)[0]
+    return send
+
+def testclient_sender(client):
+    def send(method: str, path: str, json_body=None, form=None, headers=None):
+        return client.request(method, path, json=json_body, data=form, headers=headers).status_code
+    return send
+
+def scenarios(send, tokens: list, products: int):
+    """name -> zero-argument callable returning an HTTP status."""
+    rng = random.Random(7)
+    token_cycle = itertools.cycle(tokens)
+    def auth_headers():
+        return {"Authorization": "Bearer " + next(token_cycle)}
+    def login_form():
+        return {"username": user_email(rng.randint(1, len(tokens))), "password": BENCH_PASSWORD}
+    def order_payload():
+        return {"items": [{"product_id": rng.randint(1, products), "quantity": 1} for _ in range(2)]}
+    return {
+        "GET /products": lambda: send("GET", "/products?limit=100"),
+        "GET /orders/me": lambda: send("GET", "/orders/me", headers=auth_headers()),
+        "GET /auth/me/activity": lambda: send("GET", "/auth/me/activity", headers=auth_headers()),
+        "POST /auth/login": lambda: send("POST", "/auth/login", form=login_form()),
+        "POST /orders": lambda: send("POST", "/orders", json_body=order_payload(), headers=auth_headers()),
+    }
+
+def count_queries(tokens: list, products: int, warm_calls: int = 5):
+    """SQL statements per request, measured through an in-process TestClient."""
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    import database, main as app_module
+
+    statements = [0]
+    def on_execute(*args):
+        statements[0] += 1
+    event.listen(database.engine, "before_cursor_execute", on_execute)
+    try:
+        counts = {}
+        send = testclient_sender(TestClient(app_module.app, raise_server_exceptions=False))
+        for name, call in scenarios(send, tokens, products).items():
+            observed = []
+            for _ in range(1 + warm_calls):
+                statements[0] = 0
+                call()
+                observed.append(statements[0])
+            counts[name] = {"first": observed[0], "warm": round(sum(observed[1:]) / warm_calls, 2)}
+        return counts
+    finally:
+        event.remove(database.engine, "before_cursor_execute", on_execute)
+
+def login_tokens(base_url: str, users: int, count: int = 20):
+    tokens = []
+    for n in range(1, min(users, count) + 1):
+        status, body = post_form(base_url + "/auth/login", {"username": user_email(n), "password": BENCH_PASSWORD})
+        if status != 200:
+            raise RuntimeError(f"login for {user_email(n)} failed with {status}")
+        tokens.append(json.loads(body)["access_token"])
+    return tokens
+
+def compare(current: dict, baseline: dict, max_regression: float):
+    regressions = []
+    for name, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        if before["rps"] and result["rps"] < before["rps"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {before['rps']} -> {result['rps']} rps")
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']} -> {result['p95_ms']} ms")
+        if result["queries_per_request"]["warm"] > before["queries_per_request"]["warm"]:
+            regressions.append(f"{name}: warm queries/request {before['queries_per_request']['warm']} -> {result['queries_per_request']['warm']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--endpoints", help="comma-separated subset, e.g. 'GET /products,POST /orders'")
+    parser.add_argument("--out", help="also write results to this file")
+    parser.add_argument("--compare", help="baseline results file")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+
+    results = {
+        "config": {key: getattr(args, key) for key in ("products", "users", "orders", "concurrency", "seconds")},
+        "data": generate(args.products, args.users, args.orders, seed=args.seed),
+        "endpoints": {},
+    }
+    selected = set(args.endpoints.split(",")) if args.endpoints else None
+    with serve() as base_url:
+        tokens = login_tokens(base_url, args.users)
+        for name, call in scenarios(http_sender(base_url), tokens, args.products).items():
+            if selected is None or name in selected:
+                results["endpoints"][name] = run_load(call, args.concurrency, args.seconds)
+    # Counted after the load run so the server subprocess has released the database.
+    for name, counts in count_queries(tokens, args.products).items():
+        if name in results["endpoints"]:
+            results["endpoints"][name]["queries_per_request"] = counts
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            results["regressions"] = compare(results, json.load(f), args.max_regression)
+        exit_code = 1 if results["regressions"] else 0
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    report(results)
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
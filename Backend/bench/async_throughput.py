@@ -0,0 +1,49 @@
+"""Throughput of the sync handlers vs DB_ASYNC=true on the read endpoints.
+
+    cd Backend && python -m bench.async_throughput --concurrency 32 --seconds 10
+    BENCH_DATABASE_URL=postgresql://... python -m bench.async_throughput
+
+The catalog cache is disabled so every request reaches the database. With
+no BENCH_DATABASE_URL a throwaway SQLite file is used (aiosqlite in async mode).
+"""
+import argparse
+import json
+import os
+
+from bench.common import BENCH_DATABASE_URL, serve, request, post_json, run_load, report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--orders", type=int, default=20, help="orders placed by the benchmark user")
+    args = parser.parse_args()
+
+    sqlite_path = os.path.abspath("bench_async.db")
+    database_url = BENCH_DATABASE_URL
+    if database_url.startswith("sqlite"):
+        database_url = f"sqlite:///{sqlite_path}"
+
+    results = {"database": database_url.split("://", 1)[0], "concurrency": args.concurrency}
+    for mode in ("sync", "async"):
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+        env = {"DATABASE_URL": database_url, "DB_ASYNC": "true" if mode == "async" else "false", "CATALOG_CACHE_SIZE": "0"}
+        with serve(env) as base_url:
+            request(base_url + "/seed_products", "POST")
+            email = f"{mode}@bench.local"
+            status, body = post_json(base_url + "/auth/register", {"email": email, "name": mode, "password": "bench-password"})
+            headers = {"Authorization": "Bearer " + json.loads(body)["access_token"]}
+            for i in range(args.orders):
+                post_json(base_url + "/orders", {"items": [{"product_id": i % 30 + 1, "quantity": 1}]}, headers)
+
+            results[mode] = {
+                "GET /products": run_load(lambda: request(base_url + "/products?limit=50")[0], args.concurrency, args.seconds),
+                "GET /orders/me": run_load(lambda: request(base_url + "/orders/me", headers=headers)[0], args.concurrency, args.seconds),
+            }
+    if os.path.exists(sqlite_path):
+        os.remove(sqlite_path)
+    report(results)
+
+if __name__ == "__main__":
+    main()
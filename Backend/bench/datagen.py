@@ -0,0 +1,112 @@
+"""Synthetic catalog, users and orders for benchmarks.
+
+    cd Backend && python -m bench.datagen --products 10000 --users 1000 --orders 20000
+
+Recreates every table in BENCH_DATABASE_URL (a throwaway SQLite file by default) and
+bulk-loads it. Every user is user<N>@bench.local with password BENCH_PASSWORD.
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from bench.common import CATEGORIES, report
+from sqlalchemy import func, insert, text
+import analytics, auth, crud, database, models
+
+BENCH_PASSWORD = "bench-password"
+BATCH = 10000
+
+def user_email(n: int) -> str:
+    return f"user{n}@bench.local"
+
+def _bulk(db, model, rows):
+    for start in range(0, len(rows), BATCH):
+        db.execute(insert(model), rows[start:start + BATCH])
+
+def _reset_sequences(db):
+    # Rows are inserted with explicit ids; move Postgres sequences past them so
+    # the API's own inserts don't collide.
+    if db.bind.dialect.name != "postgresql":
+        return
+    for table in models.Base.metadata.sorted_tables:
+        if "id" in table.c:
+            db.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+            ))
+
+def generate(products: int, users: int, orders: int, items_per_order: int = 3, days: int = 365, seed: int = 42):
+    rng = random.Random(seed)
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+
+    prices = [round(rng.uniform(5, 3000), 2) for _ in range(products)]
+    _bulk(db, models.Product, [
+        {
+            "id": i + 1,
+            "sku": f"BENCH-{i + 1:08d}",
+            "name": f"Product {i + 1:08d}",
+            "price": prices[i],
+            "description": "Synthetic benchmark product",
+            "image": "https://example.invalid/p.jpg",
+            "category": rng.choice(CATEGORIES),
+        }
+        for i in range(products)
+    ])
+    # One hash shared by every user: hashing per user would dominate generation time.
+    hashed_password = auth.get_password_hash(BENCH_PASSWORD)
+    _bulk(db, models.User, [
+        {"id": i + 1, "email": user_email(i + 1), "name": f"User {i + 1}", "hashed_password": hashed_password}
+        for i in range(users)
+    ])
+
+    now = datetime.utcnow()
+    item_id = 0
+    for start in range(0, orders, BATCH):
+        order_rows, item_rows = [], []
+        for order_id in range(start + 1, min(orders, start + BATCH) + 1):
+            total = 0.0
+            for _ in range(rng.randint(1, items_per_order)):
+                product_id = rng.randint(1, products)
+                quantity = rng.randint(1, 3)
+                item_id += 1
+                item_rows.append({"id": item_id, "order_id": order_id, "product_id": product_id, "quantity": quantity, "price": prices[product_id - 1]})
+                total += prices[product_id - 1] * quantity
+            order_rows.append({
+                "id": order_id,
+                "user_id": rng.randint(1, users),
+                "total_price": round(total, 2),
+                "status": "pending",
+                "created_at": now - timedelta(seconds=rng.randint(0, days * 86400)),
+            })
+        _bulk(db, models.Order, order_rows)
+        _bulk(db, models.OrderItem, item_rows)
+    _reset_sequences(db)
+    db.commit()
+    crud.backfill_user_stats(db)
+    analytics.rebuild(db)
+    counts = {
+        "products": db.query(func.count(models.Product.id)).scalar(),
+        "users": db.query(func.count(models.User.id)).scalar(),
+        "orders": db.query(func.count(models.Order.id)).scalar(),
+        "order_items": db.query(func.count(models.OrderItem.id)).scalar(),
+        "user_stats": db.query(func.count(models.UserStats.user_id)).scalar(),
+        "daily_product_sales": db.query(func.count()).select_from(models.DailyProductSales).scalar(),
+    }
+    db.close()
+    return counts
+
+def add_arguments(parser):
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    report(generate(args.products, args.users, args.orders, seed=args.seed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Flash sale: many buyers racing for one limited-stock product.
+
+    cd Backend && python -m bench.flash_sale --stock 500 --buyers 200 --concurrency 64
+    python -m bench.flash_sale --reserve     # reserve, then order (checkout flow)
+
+Every client keeps ordering the hot product until it is sold out (409). The
+database is then audited: units sold plus remaining stock must equal the
+initial stock, remaining stock must not be negative, and every 200 response
+must match exactly one order. Exits non-zero if any check fails, and reports
+the orders/second achieved until sell-out.
+"""
+import argparse
+import itertools
+import sys
+import threading
+import time
+
+from bench.common import serve, post_json, summarize, report
+from bench.datagen import user_email, generate
+from sqlalchemy import func, update
+import auth, database, models
+
+HOT_PRODUCT = 1
+
+def buy(base_url: str, token: str, quantity: int, reserve: bool):
+    headers = {"Authorization": "Bearer " + token}
+    if reserve:
+        status, _ = post_json(base_url + "/reservations", {"product_id": HOT_PRODUCT, "quantity": quantity}, headers)
+        if status != 201:
+            return status
+    status, _ = post_json(base_url + "/orders", {"items": [{"product_id": HOT_PRODUCT, "quantity": quantity}]}, headers)
+    return status
+
+def run_sale(base_url: str, tokens: list, concurrency: int, quantity: int, reserve: bool, timeout: float):
+    deadline = time.monotonic() + timeout
+    token_cycle = itertools.cycle(tokens)
+    lock = threading.Lock()
+    samples, statuses = [], {}
+    sold_out_at = [None]
+
+    def worker():
+        while time.monotonic() < deadline:
+            with lock:
+                token = next(token_cycle)
+            start = time.perf_counter()
+            try:
+                status = buy(base_url, token, quantity, reserve)
+            except OSError:
+                status = "error"
+            elapsed = time.perf_counter()
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    samples.append((elapsed - start) * 1000)
+                elif status == 409:
+                    sold_out_at[0] = sold_out_at[0] or elapsed
+            if status == 409:
+                return
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = (sold_out_at[0] or time.perf_counter()) - started
+    result = {"order_latency": summarize(samples) if samples else {"n": 0}}
+    result["seconds_to_sell_out"] = round(duration, 3) if sold_out_at[0] else None
+    result["orders_per_second"] = round(len(samples) / duration, 1) if duration > 0 else None
+    result["status_counts"] = {str(k): v for k, v in statuses.items()}
+    return result, statuses.get(200, 0)
+
+def audit(initial_stock: int, successful_orders: int, quantity: int):
+    db = database.SessionLocal()
+    try:
+        stock = db.query(models.Product.stock).filter(models.Product.id == HOT_PRODUCT).scalar()
+        sold, orders = db.query(func.coalesce(func.sum(models.OrderItem.quantity), 0), func.count(models.OrderItem.id)).join(models.Order).filter(
+            models.OrderItem.product_id == HOT_PRODUCT, models.Order.status != "cancelled"
+        ).one()
+        reserved = db.query(func.coalesce(func.sum(models.StockReservation.quantity), 0)).filter(
+            models.StockReservation.product_id == HOT_PRODUCT
+        ).scalar()
+    finally:
+        db.close()
+    checks = {
+        "stock_not_negative": stock >= 0,
+        "units_accounted_for": sold + reserved + stock == initial_stock,
+        "not_oversold": sold <= initial_stock,
+        "one_order_per_success": orders == successful_orders,
+        "sold_out": stock + reserved < quantity,
+    }
+    return {"initial_stock": initial_stock, "sold": sold, "reserved": reserved, "remaining_stock": stock, "orders": orders, "checks": checks}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stock", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=200, help="distinct user accounts")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--quantity", type=int, default=1, help="units per order")
+    parser.add_argument("--reserve", action="store_true", help="reserve stock before each order")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    generate(products=100, users=args.buyers, orders=0)
+    db = database.SessionLocal()
+    db.execute(update(models.Product).where(models.Product.id == HOT_PRODUCT).values(stock=args.stock))
+    db.commit()
+    db.close()
+    # Signed directly rather than through /auth/login, so bcrypt stays out of the measurement.
+    tokens = [auth.create_access_token(data={"sub": user_email(n)}) for n in range(1, args.buyers + 1)]
+
+    with serve() as base_url:
+        results, successes = run_sale(base_url, tokens, args.concurrency, args.quantity, args.reserve, args.timeout)
+    results["config"] = {key: getattr(args, key) for key in ("stock", "buyers", "concurrency", "quantity", "reserve")}
+    results["audit"] = audit(args.stock, successes, args.quantity)
+    report(results)
+    sys.exit(0 if all(results["audit"]["checks"].values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Catalog latency while a burst of logins hammers bcrypt.
+
+    cd Backend && python -m bench.login_storm --storm 64 --seconds 10
+
+Runs the API once with HASH_WORKERS=0 (bcrypt inline in the request thread
+pool, the old behaviour) and once with the dedicated hashing pool, and
+reports GET /products latency with and without the login storm.
+"""
+import argparse
+import os
+import threading
+import time
+
+from bench.common import serve, request, post_json, post_form, summarize, report
+
+def run_load(base_url: str, storm: int, readers: int, seconds: float):
+    stop = time.monotonic() + seconds
+    catalog = []
+    logins = {}
+    lock = threading.Lock()
+
+    def login_loop():
+        while time.monotonic() < stop:
+            try:
+                status, _ = post_form(base_url + "/auth/login", {"username": "storm@bench.local", "password": "storm-password"})
+            except OSError:
+                status = "timeout"
+            with lock:
+                logins[status] = logins.get(status, 0) + 1
+
+    def catalog_loop():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            request(base_url + "/products?limit=100")
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                catalog.append(elapsed)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(storm)]
+    threads += [threading.Thread(target=catalog_loop) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"catalog": summarize(catalog), "login_status_counts": logins}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--storm", type=int, default=64, help="concurrent login clients")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent catalog clients")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--hash-workers", type=int, default=2)
+    args = parser.parse_args()
+
+    results = {}
+    db_path = os.path.abspath("bench_login_storm.db")
+    for label, workers in (("inline", 0), ("pool", args.hash_workers)):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        env = {"DATABASE_URL": f"sqlite:///{db_path}", "HASH_WORKERS": str(workers)}
+        with serve(env) as base_url:
+            request(base_url + "/seed_products", "POST")
+            post_json(base_url + "/auth/register", {"email": "storm@bench.local", "name": "Storm", "password": "storm-password"})
+            results[label] = {
+                "idle": run_load(base_url, 0, args.readers, args.seconds / 2),
+                "storm": run_load(base_url, args.storm, args.readers, args.seconds),
+            }
+    os.remove(db_path)
+    report(results)
+
+if __name__ == "__main__":
+    main()
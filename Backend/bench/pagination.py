@@ -0,0 +1,71 @@
+"""Offset vs keyset pagination over a large catalog.
+
+    cd Backend && python -m bench.pagination --products 1000000
+
+Fills the products table up to --products rows (reusing rows from an earlier
+run) and times the first and a deep page for both strategies.
+"""
+import argparse
+import random
+
+from bench.common import CATEGORIES, timed, report
+from sqlalchemy import func, insert
+import crud, database, models
+
+def fill_products(db, total: int, batch: int = 50000):
+    existing = db.query(func.count(models.Product.id)).scalar()
+    rng = random.Random(existing)
+    while existing < total:
+        rows = [
+            {
+                "name": f"Product {i:07d}",
+                "price": round(rng.uniform(5, 3000), 2),
+                "description": "Synthetic benchmark product",
+                "image": "https://example.invalid/p.jpg",
+                "category": rng.choice(CATEGORIES),
+            }
+            for i in range(existing, min(total, existing + batch))
+        ]
+        db.execute(insert(models.Product), rows)
+        db.commit()
+        existing += len(rows)
+    return existing
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--depth", type=float, default=0.9, help="position of the deep page as a fraction of the result set")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    total = fill_products(db, args.products)
+    results = {"products": total, "limit": args.limit}
+
+    for category in (None, CATEGORIES[0]):
+        for sort in ("id", "price"):
+            matching = db.query(func.count(models.Product.id))
+            if category:
+                matching = matching.filter(models.Product.category == category)
+            deep = int(matching.scalar() * args.depth)
+
+            # Build the cursor that keyset pagination would hand out just before the deep page.
+            anchor = crud.get_products(db, skip=deep - 1, limit=1, category=category, sort=sort)[0]
+            cursor = crud.product_cursor(anchor, sort)
+            def page(**kwargs):
+                return lambda: crud.get_products(db, limit=args.limit, category=category, sort=sort, **kwargs)
+
+            results[f"category={category or '*'} sort={sort}"] = {
+                "deep_page_offset": deep,
+                "offset_first": timed(page(skip=0), args.repeat),
+                "offset_deep": timed(page(skip=deep), args.repeat),
+                "keyset_first": timed(page(), args.repeat),
+                "keyset_deep": timed(page(cursor=cursor), args.repeat),
+            }
+    db.close()
+    report(results)
+
+if __name__ == "__main__":
+    main()
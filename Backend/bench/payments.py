@@ -0,0 +1,121 @@
+"""Payment pipeline: accept latency, processing throughput and correctness.
+
+    cd Backend && python -m bench.payments --payments 500 --workers 4 --latency 0.5 --failure-rate 0.2
+
+Pays --payments pending orders against the fake gateway (which sleeps
+--latency seconds per charge and fails --failure-rate of calls), half of them
+submitted twice with the same Idempotency-Key. Reports POST /payments latency,
+which should stay in milliseconds whatever the gateway latency, the time until
+every payment settled, and the attempts needed. Then audits the database: no
+order may have more than one successful payment, every paid order must have
+one, and no order may be left in payment_pending. Exits non-zero on failure.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from bench.common import serve, post_json, summarize, report
+from bench.datagen import user_email, generate
+from sqlalchemy import func
+import auth, database, models
+
+def submit(base_url: str, orders: list, tokens: dict, concurrency: int):
+    queue = iter(enumerate(orders))
+    lock = threading.Lock()
+    samples, statuses = [], {}
+
+    def worker():
+        while True:
+            with lock:
+                item = next(queue, None)
+            if item is None:
+                return
+            n, (order_id, user_id, total) = item
+            headers = {"Authorization": "Bearer " + tokens[user_id], "Idempotency-Key": f"bench-{order_id}"}
+            for _ in range(2 if n % 2 else 1):
+                start = time.perf_counter()
+                try:
+                    status, _ = post_json(base_url + "/payments", {"order_id": order_id, "amount": total}, headers)
+                except OSError:
+                    status = "error"
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    samples.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = summarize(samples)
+    result["status_counts"] = {str(k): v for k, v in statuses.items()}
+    return result
+
+def unsettled(db) -> int:
+    return db.query(func.count(models.PaymentJob.id)).filter(models.PaymentJob.status.in_(("queued", "running"))).scalar()
+
+def audit(db, expected: int):
+    payment, order = models.Payment, models.Order
+    successes = dict(db.query(payment.order_id, func.count(payment.id)).filter(payment.status == "success").group_by(payment.order_id).all())
+    paid = {order_id for (order_id,) in db.query(order.id).filter(order.status == "paid").all()}
+    statuses = dict(db.query(payment.status, func.count(payment.id)).group_by(payment.status).all())
+    attempts = dict(db.query(models.PaymentJob.attempts, func.count(models.PaymentJob.id)).group_by(models.PaymentJob.attempts).all())
+    stuck = db.query(func.count(order.id)).filter(order.status == "payment_pending").scalar()
+    checks = {
+        "one_payment_per_order": sum(statuses.values()) == expected,
+        "no_double_charge": all(count == 1 for count in successes.values()),
+        "paid_orders_match_payments": paid == set(successes),
+        "no_order_left_pending": stuck == 0,
+    }
+    return {"payment_statuses": statuses, "attempts": {str(k): v for k, v in sorted(attempts.items())}, "checks": checks}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4, help="PAYMENT_WORKERS in the server")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake gateway seconds per charge")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="fraction of retryable gateway errors")
+    parser.add_argument("--decline-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    generate(products=100, users=args.users, orders=args.payments)
+    db = database.SessionLocal()
+    orders = db.query(models.Order.id, models.Order.user_id, models.Order.total_price).order_by(models.Order.id).all()
+    db.close()
+    tokens = {user_id: auth.create_access_token(data={"sub": user_email(user_id)}) for user_id in {o.user_id for o in orders}}
+
+    env = {
+        "PAYMENT_WORKERS": str(args.workers),
+        "PAYMENT_GATEWAY": "fake",
+        "PAYMENT_GATEWAY_LATENCY": str(args.latency),
+        "PAYMENT_GATEWAY_FAILURE_RATE": str(args.failure_rate),
+        "PAYMENT_GATEWAY_DECLINE_RATE": str(args.decline_rate),
+        "PAYMENT_BACKOFF": "0.2",
+        "PAYMENT_POLL_INTERVAL": "0.2",
+    }
+    results = {"config": {key: getattr(args, key) for key in ("payments", "concurrency", "workers", "latency", "failure_rate", "decline_rate")}}
+    with serve(env) as base_url:
+        started = time.perf_counter()
+        results["accept"] = submit(base_url, orders, tokens, args.concurrency)
+        deadline = time.monotonic() + args.timeout
+        db = database.SessionLocal()
+        try:
+            while unsettled(db) and time.monotonic() < deadline:
+                db.rollback()
+                time.sleep(0.2)
+            settled = time.perf_counter() - started
+            results["seconds_to_settle"] = round(settled, 2)
+            results["payments_per_second"] = round(len(orders) / settled, 1)
+            results["audit"] = audit(db, len(orders))
+        finally:
+            db.close()
+    report(results)
+    sys.exit(0 if all(results["audit"]["checks"].values()) else 1)
+
+if __name__ == "__main__":
+    main()
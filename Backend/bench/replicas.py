@@ -0,0 +1,134 @@
+"""Read-replica routing check with local SQLite files as primary and replicas.
+
+    cd Backend && python -m bench.replicas
+    python -m bench.replicas --strategy least_connections
+
+Generates a primary database and copies it to two replica files, so the
+replicas are snapshots that never receive later writes (maximal replication
+lag). Each replica's product names are tagged, so a response shows where it
+was read from. Against a running API it then checks that:
+  * catalog and order reads are spread over the replicas,
+  * right after placing an order on one server, the user sends back its
+    X-Last-Write header and reads the order from the primary through a second,
+    separate server process; without the header the read goes to a replica,
+  * once READ_YOUR_WRITES_SECONDS passes, reads go back to the (stale) replicas,
+  * with a replica that can't be opened, reads fall back to the primary,
+  * a catalog page served from the cache doesn't use a replica connection.
+Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import urllib.request
+
+from bench.common import serve, request, report
+from bench.datagen import user_email, generate
+import auth, database
+
+STICKY_SECONDS = 2
+
+def tag_replica(path: str, tag: str):
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE products SET name = name || ?", (f" [{tag}]",))
+
+def get_json(url: str, token: str = None, last_write: str = None):
+    headers = {"Authorization": "Bearer " + token} if token else {}
+    if last_write:
+        headers["X-Last-Write"] = last_write
+    status, body = request(url, headers=headers)
+    return status, json.loads(body) if body else None
+
+def place_order(base_url: str, token: str):
+    """(order id, X-Last-Write header) of a new one-item order."""
+    req = urllib.request.Request(
+        base_url + "/orders", json.dumps({"items": [{"product_id": 1, "quantity": 1}]}).encode(),
+        {"Content-Type": "application/json", "Authorization": "Bearer " + token},
+    )
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())["id"], resp.headers.get("X-Last-Write")
+
+def source(products: list) -> str:
+    name = products[0]["name"] if products else ""
+    return name[name.rfind("[") + 1:-1] if name.endswith("]") else "primary"
+
+def replica_stats(base_url: str, token: str) -> dict:
+    return get_json(base_url + "/cache/stats", token)[1]["read_replicas"]["sync"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--strategy", choices=("round_robin", "least_connections"), default="round_robin")
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+
+    primary = database.engine.url.database
+    if database.engine.url.get_backend_name() != "sqlite":
+        parser.error("this check copies database files; point BENCH_DATABASE_URL at a SQLite file")
+    generate(products=50, users=5, orders=20)
+    database.engine.dispose()
+    replica_paths = []
+    for n in (1, 2):
+        path = os.path.join(os.path.dirname(os.path.abspath(primary)), f"bench_replica{n}.db")
+        shutil.copyfile(primary, path)
+        tag_replica(path, f"replica{n}")
+        replica_paths.append(path)
+    token = auth.create_access_token(data={"sub": user_email(1)})
+    env = {
+        "DATABASE_REPLICA_URLS": ",".join(f"sqlite:///{path}" for path in replica_paths),
+        "DB_REPLICA_STRATEGY": args.strategy,
+        "READ_YOUR_WRITES_SECONDS": str(STICKY_SECONDS),
+        "CATALOG_CACHE_SIZE": "0",  # every catalog read hits a database
+        "ADMIN_EMAILS": user_email(1),  # /cache/stats is admin-only
+    }
+    checks, results = {}, {}
+    with serve(env) as base_url, serve(env) as other_url:
+        sources = {}
+        for _ in range(args.reads):
+            _, products = get_json(base_url + "/products?limit=1&fields=id,name")
+            sources[source(products)] = sources.get(source(products), 0) + 1
+        results["catalog_sources"] = sources
+        checks["catalog_reads_from_replicas"] = "primary" not in sources
+        if args.strategy == "round_robin":
+            checks["round_robin_uses_both"] = len(sources) == 2
+
+        _, before = get_json(base_url + "/orders/me?limit=1000", token)
+        order_id, last_write = place_order(base_url, token)
+        _, after_write = get_json(other_url + "/orders/me?limit=1000", token, last_write)
+        _, without_header = get_json(other_url + "/orders/me?limit=1000", token)
+        checks["write_stamped"] = last_write is not None
+        checks["read_your_writes_on_another_process"] = order_id in {o["id"] for o in after_write}
+        checks["reads_without_stamp_use_replicas"] = order_id not in {o["id"] for o in without_header}
+        time.sleep(STICKY_SECONDS + 0.5)
+        _, later = get_json(other_url + "/orders/me?limit=1000", token, last_write)
+        checks["reads_return_to_replicas"] = order_id not in {o["id"] for o in later} and len(later) == len(before)
+        results["replicas"] = replica_stats(base_url, token)
+
+    env["DATABASE_REPLICA_URLS"] = "sqlite:////nonexistent/bench_replica.db"
+    with serve(env) as base_url:
+        statuses = [request(base_url + "/products?limit=1&fields=id,name")[0] for _ in range(3)]
+        _, products = get_json(base_url + "/products?limit=1&fields=id,name")
+        stats = replica_stats(base_url, token)
+        checks["falls_back_when_replica_down"] = statuses == [200] * 3 and source(products) == "primary"
+        checks["down_replica_marked"] = stats["fallbacks_to_primary"] >= 1 and not stats["replicas"][0]["up"]
+        results["down_replica"] = stats
+
+    env["DATABASE_REPLICA_URLS"] = ",".join(f"sqlite:///{path}" for path in replica_paths)
+    del env["CATALOG_CACHE_SIZE"]
+    with serve(env) as base_url:
+        served = []
+        for _ in range(3):
+            request(base_url + "/products?limit=1&fields=id,name")
+            served.append(sum(r["served"] for r in replica_stats(base_url, token)["replicas"]))
+        checks["cache_hits_skip_replicas"] = served[0] == served[1] == served[2]
+        results["served_after_each_cached_read"] = served
+
+    for path in replica_paths:
+        os.remove(path)
+    report({"config": vars(args), "results": results, "checks": checks})
+    sys.exit(0 if all(checks.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Latency of GET /products/search's backend over a large catalog.
+
+    cd Backend && python -m bench.search --products 1000000
+    BENCH_DATABASE_URL=postgresql://... python -m bench.search --products 1000000
+
+On SQLite this measures the in-process inverted index (including its initial
+build); on Postgres, the GIN-backed tsquery path.
+"""
+import argparse
+import time
+
+from bench.common import CATEGORIES, timed, report
+from bench.pagination import fill_products
+import database, models, search
+
+QUERIES = ["product", "product 00012", "produ", "synthetic bench", "laptops", "0099999", "nothing-matches"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    results = {"products": fill_products(db, args.products), "backend": db.bind.dialect.name}
+
+    start = time.perf_counter()
+    search.search_products(db, "warmup")
+    results["first_query_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    for query in QUERIES:
+        for category in (None, CATEGORIES[1]):
+            label = f"q={query!r} category={category or '*'}"
+            results[label] = timed(lambda: search.search_products(db, query, category=category), args.repeat)
+            results[label]["total"] = search.search_products(db, query, category=category)[1]
+    db.close()
+    report(results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Catalog serialization: CPU per response and bytes on the wire.
+
+    cd Backend && python -m bench.serialization --products 2000 --limit 100
+
+Two measurements, both in-process:
+  * serializer: CPU to turn one page of Product rows into JSON, the old way
+    (validate every row through schemas.Product, jsonable_encoder, json.dumps)
+    against responses.serialize_products (plain dicts, orjson when installed),
+    with and without a sparse `fields=` selection;
+  * http: GET /products through a TestClient for each fields/encoding
+    combination, reporting CPU per request with the catalog cache cleared
+    before every request (cold) and left warm, plus the response size.
+CPU is process time, so the http figures include the client's share too.
+"""
+import argparse
+import json
+import time
+
+from bench.common import report
+from bench.datagen import generate
+from fastapi.encoders import jsonable_encoder
+import compression, crud, database, responses, schemas
+
+SPARSE_FIELDS = "id,name,price"
+
+def cpu_ms(fn, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return round((time.process_time() - start) * 1000 / repeat, 3)
+
+def legacy_serialize(products) -> bytes:
+    # What a response_model=List[schemas.Product] handler did for every row.
+    if hasattr(schemas.Product, "model_validate"):
+        validated = [schemas.Product.model_validate(p, from_attributes=True) for p in products]
+    else:
+        validated = [schemas.Product.from_orm(p) for p in products]
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+def bench_serializer(limit: int, repeat: int):
+    db = database.SessionLocal()
+    try:
+        products = crud.get_products(db, limit=limit)
+        sparse = crud.parse_product_fields(SPARSE_FIELDS)
+        rows = crud.get_products(db, limit=limit, fields=sparse)
+    finally:
+        db.close()
+    return {
+        "legacy_ms": cpu_ms(lambda: legacy_serialize(products), repeat),
+        "fast_ms": cpu_ms(lambda: responses.serialize_products(products), repeat),
+        "fast_sparse_ms": cpu_ms(lambda: responses.serialize_products(rows, sparse), repeat),
+        "json_backend": "orjson" if responses.orjson is not None else "json",
+    }
+
+def bench_http(limit: int, repeat: int):
+    from fastapi.testclient import TestClient
+    import main
+    from cache import catalog_cache
+
+    client = TestClient(main.app)
+    results = {}
+    for fields in (None, SPARSE_FIELDS):
+        url = f"/products?limit={limit}" + (f"&fields={fields}" if fields else "")
+        for encoding in ("identity",) + compression.available_encodings():
+            headers = {"Accept-Encoding": encoding}
+            def cold():
+                catalog_cache.bump()
+                client.get(url, headers=headers)
+            response = client.get(url, headers=headers)
+            results[f"{'sparse' if fields else 'full'}/{encoding}"] = {
+                "bytes": int(response.headers["content-length"]),  # response.content is already decoded
+                "cold_cpu_ms": cpu_ms(cold, repeat),
+                "warm_cpu_ms": cpu_ms(lambda: client.get(url, headers=headers), repeat),
+            }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=100, help="page size")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    generate(products=args.products, users=1, orders=0)
+    report({
+        "config": {"products": args.products, "limit": args.limit, "repeat": args.repeat},
+        "serializer": bench_serializer(args.limit, args.repeat),
+        "http": bench_http(args.limit, args.repeat),
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Serving modes: cold start and requests/second per core.
+
+    cd Backend && python -m bench.serving --workers 4 --seconds 10
+
+Compares the old single uvicorn process, which ran create_all at import
+(AUTO_CREATE_SCHEMA=true), with gunicorn running --workers uvicorn workers
+from a preloaded app and no schema work on startup. Reports:
+  * cold start: time from spawning the server until /readyz first answers 200
+    (the schema already exists, as on any restart), over --starts runs;
+  * throughput: requests/second per endpoint under --concurrency clients, and
+    that figure divided by the cores the server could use.
+The load generator runs on the same machine, so leave it spare cores; with
+fewer cores than workers the per-core figure is what to compare.
+"""
+import argparse
+import multiprocessing
+import statistics
+import time
+
+from bench.common import serve, request, run_load, report
+from bench.datagen import generate
+
+ENDPOINTS = {
+    "healthz": "/healthz",
+    "products": "/products?limit=20",
+    "search": "/products/search?q=gaming&limit=20",
+}
+
+def modes(workers: int) -> dict:
+    return {
+        "before_uvicorn_create_all": {"server": "uvicorn", "workers": 1,
+                                      "env": {"AUTO_CREATE_SCHEMA": "true", "WEB_CONCURRENCY": "1"}},
+        "after_gunicorn_preload": {"server": "gunicorn", "workers": workers,
+                                   "env": {"AUTO_CREATE_SCHEMA": "false", "WEB_CONCURRENCY": str(workers)}},
+    }
+
+def cold_start(mode: dict, starts: int) -> dict:
+    samples = []
+    for _ in range(starts):
+        started = time.perf_counter()
+        with serve(mode["env"], server=mode["server"]):
+            samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": round(statistics.median(samples), 1), "max_ms": round(max(samples), 1)}
+
+def throughput(mode: dict, concurrency: int, seconds: float) -> dict:
+    cores = min(mode["workers"], multiprocessing.cpu_count())
+    results = {}
+    with serve(mode["env"], server=mode["server"]) as base_url:
+        for name, path in ENDPOINTS.items():
+            request(base_url + path)  # warm caches and the search index
+            result = run_load(lambda: request(base_url + path)[0], concurrency, seconds)
+            result["rps_per_core"] = round(result["rps"] / cores, 1)
+            results[name] = result
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--starts", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    generate(products=args.products, users=10, orders=100)
+    results = {"config": {**vars(args), "cpus": multiprocessing.cpu_count()}}
+    for name, mode in modes(args.workers).items():
+        results[name] = {
+            "cold_start": cold_start(mode, args.starts),
+            "throughput": throughput(mode, args.concurrency, args.seconds),
+        }
+    report(results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip is offered
+    brotli = None
+
+# Response compression.
+#
+# CompressionMiddleware compresses complete (non-streamed) JSON and text
+# responses of at least COMPRESS_MIN_SIZE bytes, with brotli when the client
+# accepts it and the package is installed, otherwise gzip. Responses that
+# already carry a Content-Encoding pass through untouched, which is how the
+# catalog serves compressed bodies it cached once (responses.catalog_response).
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1000"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def choose_encoding(accept_encoding: str):
+    """The preferred encoding we support from an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept-encoding"), None)
+        encoding = choose_encoding(accept)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if passthrough or start is None:
+                return await send(message)
+            headers = start["headers"]
+            body = message.get("body", b"")
+            content_type = next((value for name, value in headers if name == b"content-type"), b"")
+            if (message.get("more_body", False)
+                    or len(body) < self.minimum_size
+                    or any(name == b"content-encoding" for name, _ in headers)
+                    or not content_type.startswith(COMPRESSIBLE_TYPES)):
+                # Streamed, small, already encoded or binary: send as is.
+                passthrough = True
+                await send(start)
+                return await send(message)
+            body = compress(body, encoding)
+            headers = [(name, value) for name, value in headers if name != b"content-length"]
+            headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()), (b"vary", b"Accept-Encoding")]
+            await send({**start, "headers": headers})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,6 +1,10 @@
 
-from sqlalchemy.orm import Session
-import models, schemas, auth
+from sqlalchemy import select, insert, update, delete, func, case, tuple_
+from sqlalchemy.orm import Session, selectinload
+from datetime import datetime
+import models, schemas, auth, analytics, database, inventory, search
+from cache import catalog_cache
+from pagination import encode_cursor, decode_cursor, InvalidCursor
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -16,44 +20,218 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def get_products(db: Session, skip: int = 0, limit: int = 100, category: str = None):
-    query = db.query(models.Product)
+# sort name -> (sort column, descending); every sort is tie-broken on id so the
+# keyset is unique and matches the composite indexes on models.Product.
+PRODUCT_SORTS = {
+    "id": (None, False),
+    "price": (models.Product.price, False),
+    "-price": (models.Product.price, True),
+    "name": (models.Product.name, False),
+}
+
+# Columns a client may ask for with `fields=`, in response order. stock in a
+# cached page can lag by up to CATALOG_CACHE_TTL; orders re-check it.
+PRODUCT_FIELDS = ("id", "sku", "name", "price", "description", "image", "category", "stock")
+
+class InvalidFields(ValueError):
+    pass
+
+def parse_product_fields(fields: str = None):
+    """Turn a `fields=id,price` parameter into a tuple in PRODUCT_FIELDS order; None means all."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(PRODUCT_FIELDS)
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(field for field in PRODUCT_FIELDS if field in requested) or None
+
+def products_statement(skip: int = 0, limit: int = 100, category: str = None, sort: str = "id", cursor: str = None, fields: tuple = None):
+    # Built as a select() so async_crud can execute the same query. With
+    # `fields` only those columns (plus the keyset columns) are selected, and
+    # rows are returned instead of Product instances.
+    if sort not in PRODUCT_SORTS:
+        raise InvalidCursor(f"Unknown sort '{sort}'")
+    column, descending = PRODUCT_SORTS[sort]
+    keys = [column, models.Product.id] if column is not None else [models.Product.id]
+
+    if fields:
+        needed = set(fields) | {key.key for key in keys}
+        query = select(*[getattr(models.Product, field) for field in PRODUCT_FIELDS if field in needed])
+    else:
+        query = select(models.Product)
     if category:
         query = query.filter(models.Product.category == category)
-    return query.offset(skip).limit(limit).all()
+    if cursor:
+        cursor_sort, *last = decode_cursor(cursor, len(keys) + 1)
+        if cursor_sort != sort:
+            raise InvalidCursor("Cursor was issued for a different sort")
+        if not isinstance(last[-1], int):
+            raise InvalidCursor("Malformed cursor")
+        if descending:
+            query = query.filter(tuple_(*keys) < tuple_(*last))
+        else:
+            query = query.filter(tuple_(*keys) > tuple_(*last))
+    query = query.order_by(*[key.desc() if descending else key.asc() for key in keys])
+    if skip and not cursor:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def get_products(db: Session, skip: int = 0, limit: int = 100, category: str = None, sort: str = "id", cursor: str = None, fields: tuple = None):
+    result = db.execute(products_statement(skip, limit, category, sort, cursor, fields))
+    return result.all() if fields else result.scalars().all()
+
+def product_cursor(product: models.Product, sort: str = "id") -> str:
+    column, _ = PRODUCT_SORTS[sort]
+    if column is None:
+        return encode_cursor(sort, product.id)
+    return encode_cursor(sort, getattr(product, column.key), product.id)
+
+def get_product(db: Session, product_id: int):
+    return db.query(models.Product).filter(models.Product.id == product_id).first()
 
 def create_product(db: Session, product: schemas.ProductCreate):
     db_product = models.Product(**product.dict())
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    if search.uses_index(db):
+        search.product_index.add(db_product)
+    catalog_cache.bump()
     return db_product
 
+# Items and their products in two IN queries, however many orders are loaded.
+ORDER_ITEMS_LOADER = selectinload(models.Order.items).selectinload(models.OrderItem.product)
+
+class UnknownProducts(ValueError):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Unknown product ids: {self.product_ids}")
+
+class OrderNotCancellable(ValueError):
+    pass
+
 def create_order(db: Session, order: schemas.OrderCreate, user_id: int):
-    # Calculate total price
-    total_price = 0
-    db_order_items = []
-    
-    # First create the order object
-    db_order = models.Order(user_id=user_id, total_price=0, status="pending")
+    # One transaction: a single IN query for every referenced product, then the
+    # order and all of its items are flushed together and committed once.
+    # Stock is taken last so hot product rows stay locked only until the commit.
+    product_ids = {item.product_id for item in order.items}
+    products = {
+        p.id: p for p in db.query(models.Product.id, models.Product.price, models.Product.category).filter(models.Product.id.in_(product_ids))
+    } if product_ids else {}
+    prices = {product_id: p.price for product_id, p in products.items()}
+    missing = product_ids - prices.keys()
+    if missing:
+        raise UnknownProducts(missing)
+
+    db_order = models.Order(user_id=user_id, status="pending", created_at=datetime.utcnow())
+    db_order.items = [
+        models.OrderItem(product_id=item.product_id, quantity=item.quantity, price=prices[item.product_id])
+        for item in order.items
+    ]
+    db_order.total_price = sum(i.price * i.quantity for i in db_order.items)
     db.add(db_order)
+    record_user_order(db, user_id, db_order.total_price, db_order.created_at)
+    db.flush()
+    analytics.record_order(db, db_order.id, db_order.created_at, [
+        (i.product_id, products[i.product_id].category, i.quantity, i.price) for i in db_order.items
+    ])
+    quantities = {}
+    for item in order.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    inventory.allocate(db, user_id, quantities)
     db.commit()
-    db.refresh(db_order)
+    return get_order(db, db_order.id)
 
-    for item in order.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if product:
-            item_price = product.price
-            total_price += item_price * item.quantity
-            db_item = models.OrderItem(order_id=db_order.id, product_id=item.product_id, quantity=item.quantity, price=item_price)
-            db.add(db_item)
-    
-    db_order.total_price = total_price
+def get_order(db: Session, order_id: int, user_id: int = None):
+    query = db.query(models.Order).options(ORDER_ITEMS_LOADER).filter(models.Order.id == order_id)
+    if user_id is not None:
+        query = query.filter(models.Order.user_id == user_id)
+    return query.first()
+
+def cancel_order(db: Session, order_id: int, user_id: int):
+    """Cancel a pending order and return its stock; None if the user has no such order."""
+    order = models.Order
+    cancelled = db.execute(
+        update(order).where(order.id == order_id, order.user_id == user_id, order.status == "pending")
+        .values(status="cancelled").execution_options(synchronize_session=False)
+    ).rowcount
+    if not cancelled:
+        db.rollback()
+        db_order = get_order(db, order_id, user_id)
+        if db_order is None:
+            return None
+        raise OrderNotCancellable(f"Order is {db_order.status} and can no longer be cancelled")
+    # Cancelled orders stay in the history (and order_count) but not in lifetime spend or sales.
+    # user_stats is locked before the product rows, as in create_order, so an
+    # order and a cancellation by the same user can't deadlock.
+    total, created_at = db.query(order.total_price, order.created_at).filter(order.id == order_id).one()
+    stats = models.UserStats
+    db.execute(update(stats).where(stats.user_id == user_id).values(total_spent=stats.total_spent - total))
+    analytics.record_order(db, order_id, created_at, analytics.order_lines(db, order_id, created_at.date()), sign=-1)
+    item = models.OrderItem
+    inventory.restock(db, dict(
+        db.query(item.product_id, func.sum(item.quantity)).filter(item.order_id == order_id).group_by(item.product_id).all()
+    ))
+    db.commit()
+    db.expire_all()
+    return get_order(db, order_id, user_id)
+
+def record_user_order(db: Session, user_id: int, total: float, created_at: datetime):
+    # A relative upsert in the caller's transaction, so concurrent orders from
+    # the same user serialize on the row instead of losing increments.
+    stats = models.UserStats
+    database.upsert(
+        db, stats,
+        [{"user_id": user_id, "order_count": 1, "total_spent": total, "first_order_at": created_at, "last_order_at": created_at}],
+        ("user_id",),
+        lambda new: {
+            "order_count": stats.order_count + new["order_count"],
+            "total_spent": stats.total_spent + new["total_spent"],
+            "first_order_at": func.coalesce(stats.first_order_at, new["first_order_at"]),
+            "last_order_at": new["last_order_at"],
+        },
+    )
+
+def get_user_activity(db: Session, user_id: int):
+    stats = models.UserStats
+    return db.query(
+        models.User.created_at, stats.order_count, stats.total_spent, stats.first_order_at, stats.last_order_at
+    ).outerjoin(stats, stats.user_id == models.User.id).filter(models.User.id == user_id).first()
+
+def backfill_user_stats(db: Session) -> int:
+    """Rebuild user_stats from the orders table; returns the number of users with orders.
+
+    Cancelled orders count towards order_count but not total_spent, as in cancel_order.
+
+    Run it with order creation paused: orders committed while it runs may be
+    counted twice or not at all.
+    """
+    order, stats = models.Order, models.UserStats
+    db.execute(delete(stats))
+    db.execute(insert(stats).from_select(
+        ["user_id", "order_count", "total_spent", "first_order_at", "last_order_at"],
+        select(
+            order.user_id,
+            func.count(order.id),
+            func.coalesce(func.sum(case((order.status != "cancelled", order.total_price), else_=0)), 0),
+            func.min(order.created_at),
+            func.max(order.created_at),
+        ).where(order.user_id.isnot(None)).group_by(order.user_id),
+    ))
+    # Accounts created before users.created_at existed: the first order is the
+    # best known bound. Users without orders are left NULL.
+    db.execute(
+        update(models.User).where(models.User.created_at.is_(None)).values(
+            created_at=select(stats.first_order_at).where(stats.user_id == models.User.id).scalar_subquery()
+        )
+    )
     db.commit()
-    db.refresh(db_order)
-    return db_order
+    return db.query(func.count(stats.user_id)).scalar()
 
 def update_user(db: Session, db_user: models.User, user_update: schemas.UserUpdate):
+    # Evict under the old email now and the (possibly new) one after commit.
+    auth.invalidate_user(db_user.email)
     if user_update.name:
         db_user.name = user_update.name
     if user_update.email:
@@ -62,7 +240,31 @@ def update_user(db: Session, db_user: models.User, user_update: schemas.UserUpda
         db_user.hashed_password = auth.get_password_hash(user_update.password)
     db.commit()
     db.refresh(db_user)
+    auth.invalidate_user(db_user.email)
     return db_user
 
-def get_user_orders(db: Session, user_id: int):
-    return db.query(models.Order).filter(models.Order.user_id == user_id).order_by(models.Order.created_at.desc()).all()
+def update_password_hash(db: Session, db_user: models.User, hashed_password: str):
+    db_user.hashed_password = hashed_password
+    db.commit()
+
+def user_orders_statement(user_id: int, limit: int = None, cursor: str = None):
+    # Newest first, keyed on (created_at, id) so the cursor is unique and the
+    # scan is served by ix_orders_user_id_created_at.
+    query = select(models.Order).filter(models.Order.user_id == user_id).options(ORDER_ITEMS_LOADER)
+    if cursor:
+        created_at, last_id = decode_cursor(cursor, 2)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise InvalidCursor("Malformed cursor")
+        query = query.filter(tuple_(models.Order.created_at, models.Order.id) < tuple_(created_at, last_id))
+    query = query.order_by(models.Order.created_at.desc(), models.Order.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def get_user_orders(db: Session, user_id: int, limit: int = None, cursor: str = None):
+    return db.execute(user_orders_statement(user_id, limit, cursor)).scalars().all()
+
+def order_cursor(order: models.Order) -> str:
+    return encode_cursor(order.created_at.isoformat(), order.id)
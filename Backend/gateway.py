@@ -0,0 +1,63 @@
+import os
+import random
+import threading
+import time
+import uuid
+
+# Payment gateway used by the payment workers (payments.py).
+#
+# PAYMENT_GATEWAY picks the gateway and has no default: without it payments
+# are disabled rather than silently "charged" by the simulator.
+#
+# Only the local fake (PAYMENT_GATEWAY=fake, for development and benchmarks)
+# exists so far. It sleeps PAYMENT_GATEWAY_LATENCY seconds per charge and fails
+# a PAYMENT_GATEWAY_FAILURE_RATE fraction of calls with a retryable error and a
+# PAYMENT_GATEWAY_DECLINE_RATE fraction with a permanent decline. Like a real
+# gateway, it returns the original charge when it sees an idempotency key
+# again, so a retried job never charges twice.
+
+class GatewayError(Exception):
+    """Transient failure (timeout, 5xx): the charge may be retried."""
+
+class PaymentDeclined(Exception):
+    """Permanent failure: retrying will not help."""
+
+class FakeGateway:
+    name = "fake"
+
+    def __init__(self, latency: float = 0.2, failure_rate: float = 0.0, decline_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._charges = {}  # idempotency key -> reference
+        self.calls = 0
+
+    def charge(self, amount: float, idempotency_key: str) -> str:
+        """Charge `amount` and return the gateway's reference for it."""
+        with self._lock:
+            self.calls += 1
+            if idempotency_key in self._charges:
+                return self._charges[idempotency_key]
+            roll = self._random.random()
+        time.sleep(self.latency)
+        if roll < self.failure_rate:
+            raise GatewayError("Gateway timed out")
+        if roll < self.failure_rate + self.decline_rate:
+            raise PaymentDeclined("Card declined")
+        with self._lock:
+            return self._charges.setdefault(idempotency_key, "fake_" + uuid.uuid4().hex)
+
+def from_env():
+    """The configured gateway, or None if PAYMENT_GATEWAY is not set."""
+    provider = os.getenv("PAYMENT_GATEWAY", "").strip()
+    if not provider:
+        return None
+    if provider != "fake":
+        raise ValueError(f"Unknown PAYMENT_GATEWAY '{provider}'")
+    return FakeGateway(
+        latency=float(os.getenv("PAYMENT_GATEWAY_LATENCY", "0.2")),
+        failure_rate=float(os.getenv("PAYMENT_GATEWAY_FAILURE_RATE", "0")),
+        decline_rate=float(os.getenv("PAYMENT_GATEWAY_DECLINE_RATE", "0")),
+    )
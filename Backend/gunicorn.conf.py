@@ -0,0 +1,33 @@
+"""gunicorn settings for production serving, picked up by `gunicorn main:app`.
+
+Runs WEB_CONCURRENCY uvicorn workers (one per core by default). The app is
+imported once in the master (preload_app) and forked, so workers start
+without re-importing it. Nothing in main.py touches the database at import;
+run `python manage.py init-db` before starting the server.
+
+Each worker has its own database pools (split from DB_MAX_CONNECTIONS, see
+database.py), payment workers (PAYMENT_WORKERS), sales rollup folding thread
+(ANALYTICS_FOLD_INTERVAL) and password hashing processes (HASH_WORKERS), and
+its own caches and /metrics counters.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+# database.py sizes the per-worker connection pools from it.
+os.environ["WEB_CONCURRENCY"] = str(workers)
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recycle workers after this many requests (0 = never), staggered by the jitter.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+def post_fork(server, worker):
+    import database
+
+    database.dispose_engines()
@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+import database, models, schemas, search
+from cache import catalog_cache
+
+# Streaming bulk product import (POST /products/import, `manage.py import-products`).
+#
+# Rows are read one at a time, validated with schemas.ProductCreate and written
+# in batches of IMPORT_BATCH_SIZE, one multi-row INSERT and one commit per
+# batch. Rows with a sku are upserted on it. Bad rows are reported and skipped,
+# so memory stays flat however large the input is.
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+MAX_REPORTED_ERRORS = 100
+PRODUCT_COLUMNS = ("sku", "name", "price", "description", "image", "category", "stock")
+# Live stock belongs to inventory.py once a product exists; a feed only sets it on insert.
+UPSERT_COLUMNS = tuple(column for column in PRODUCT_COLUMNS if column not in ("sku", "stock"))
+
+def detect_format(filename: str, default: str = "ndjson") -> str:
+    if filename:
+        extension = filename.rsplit(".", 1)[-1].lower()
+        if extension == "csv":
+            return "csv"
+        if extension in ("ndjson", "jsonl"):
+            return "ndjson"
+    return default
+
+def iter_rows(stream, fmt: str):
+    """Yield (row number, dict or parse error) from a text stream opened with newline=""."""
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, e
+            continue
+        yield number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def dict(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+def _write_rows(db: Session, rows: list, upsert: bool):
+    if upsert:
+        database.upsert(db, models.Product, rows, ("sku",), lambda new: {column: new[column] for column in UPSERT_COLUMNS})
+    else:
+        db.execute(insert(models.Product), rows)
+
+def _write_batch(db: Session, batch: list, report: ImportReport):
+    # A sku appearing twice in one batch would make the upsert touch a row twice;
+    # the last row wins and the earlier ones are reported as not imported.
+    last = {}
+    for number, values in batch:
+        if values["sku"]:
+            if values["sku"] in last:
+                report.error(last[values["sku"]][0], f"Superseded by row {number} with the same sku '{values['sku']}'")
+            last[values["sku"]] = (number, values)
+    with_sku = list(last.values())
+    without_sku = [(number, values) for number, values in batch if not values["sku"]]
+    try:
+        for upsert, rows in ((True, with_sku), (False, without_sku)):
+            if rows:
+                _write_rows(db, [values for _, values in rows], upsert)
+        db.commit()
+        report.imported += len(with_sku) + len(without_sku)
+        return
+    except SQLAlchemyError:
+        db.rollback()
+    # Something in the batch was rejected by the database: retry row by row to isolate it.
+    for upsert, rows in ((True, with_sku), (False, without_sku)):
+        for number, values in rows:
+            try:
+                _write_rows(db, [values], upsert)
+                db.commit()
+                report.imported += 1
+            except SQLAlchemyError as e:
+                db.rollback()
+                report.error(number, str(e.orig if getattr(e, "orig", None) else e).strip())
+
+def import_products(db: Session, rows, batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    report = ImportReport()
+    batch = []
+    for number, row in rows:
+        if isinstance(row, Exception):
+            report.error(number, str(row))
+            continue
+        try:
+            product = schemas.ProductCreate(**{k: v for k, v in row.items() if v not in ("", None)})
+        except (ValidationError, TypeError) as e:
+            report.error(number, str(e))
+            continue
+        batch.append((number, {column: getattr(product, column) for column in PRODUCT_COLUMNS}))
+        if len(batch) >= batch_size:
+            _write_batch(db, batch, report)
+            batch = []
+    if batch:
+        _write_batch(db, batch, report)
+    if report.imported:
+        catalog_cache.bump()
+        # Upserts change indexed text in place, so rebuild rather than append.
+        search.product_index.reset()
+    return report
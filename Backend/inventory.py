@@ -0,0 +1,125 @@
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+import models
+
+# Stock tracking for crud.create_order and the reservation endpoints.
+#
+# products.stock is the quantity still available to sell; NULL means the
+# product is not tracked. Every change is a single conditional UPDATE on the
+# product row (`stock = stock - q WHERE stock >= q`), so concurrent buyers of a
+# hot product queue on that one row lock for the tail of their transaction
+# instead of locking orders or reading-then-writing a stale count. NULL - q is
+# still NULL, so untracked products go through the same statements unchanged.
+#
+# A reservation moves stock out of products.stock for RESERVATION_TTL seconds.
+# Placing an order consumes the buyer's live reservations for its products;
+# expired ones are handed back lazily, when a product runs out.
+
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "600"))
+
+class OutOfStock(ValueError):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Insufficient stock for product ids: {self.product_ids}")
+
+def _take(db: Session, product_id: int, quantity: int) -> bool:
+    product = models.Product
+    return db.execute(
+        update(product)
+        .where(product.id == product_id, (product.stock.is_(None)) | (product.stock >= quantity))
+        .values(stock=product.stock - quantity)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def _give_back(db: Session, product_id: int, quantity: int):
+    product = models.Product
+    db.execute(
+        update(product).where(product.id == product_id).values(stock=product.stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+def _claim(db: Session, reservation_id: int) -> bool:
+    # Deleting by id is the claim: of two requests releasing or consuming the
+    # same reservation, only the one whose DELETE hits the row may move stock.
+    reservation = models.StockReservation
+    return db.execute(
+        delete(reservation).where(reservation.id == reservation_id).execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+def take_stock(db: Session, product_id: int, quantity: int) -> bool:
+    """Decrement stock, reclaiming expired reservations once if it runs short."""
+    if _take(db, product_id, quantity):
+        return True
+    return release_expired_reservations(db, product_id) > 0 and _take(db, product_id, quantity)
+
+def release_expired_reservations(db: Session, product_id: int = None) -> int:
+    """Return expired reservations to stock; the caller commits. Returns how many were released."""
+    reservation = models.StockReservation
+    query = select(reservation.id, reservation.product_id, reservation.quantity).where(reservation.expires_at <= datetime.utcnow())
+    if product_id is not None:
+        query = query.where(reservation.product_id == product_id)
+    released = 0
+    for reservation_id, reserved_product, quantity in db.execute(query).all():
+        if _claim(db, reservation_id):
+            _give_back(db, reserved_product, quantity)
+            released += 1
+    return released
+
+def reserve(db: Session, user_id: int, product_id: int, quantity: int) -> models.StockReservation:
+    if not take_stock(db, product_id, quantity):
+        db.rollback()
+        raise OutOfStock([product_id])
+    db_reservation = models.StockReservation(
+        product_id=product_id,
+        user_id=user_id,
+        quantity=quantity,
+        expires_at=datetime.utcnow() + timedelta(seconds=RESERVATION_TTL),
+    )
+    db.add(db_reservation)
+    db.commit()
+    db.refresh(db_reservation)
+    return db_reservation
+
+def release(db: Session, user_id: int, reservation_id: int) -> bool:
+    db_reservation = db.query(models.StockReservation).filter(
+        models.StockReservation.id == reservation_id, models.StockReservation.user_id == user_id
+    ).first()
+    if db_reservation is None:
+        return False
+    if _claim(db, db_reservation.id):
+        _give_back(db, db_reservation.product_id, db_reservation.quantity)
+    db.commit()
+    return True
+
+def allocate(db: Session, user_id: int, quantities: dict):
+    """Take stock for an order's {product_id: quantity}; the caller commits.
+
+    The buyer's live reservations are consumed first. Products are locked in id
+    order so two multi-item orders can't deadlock each other. Raises
+    OutOfStock (after rolling back) if any product is short.
+    """
+    reservation = models.StockReservation
+    reserved = db.execute(
+        select(reservation.id, reservation.product_id, reservation.quantity).where(
+            reservation.user_id == user_id,
+            reservation.product_id.in_(quantities.keys()),
+            reservation.expires_at > datetime.utcnow(),
+        ).order_by(reservation.id)
+    ).all()
+    for product_id in sorted(quantities):
+        needed = quantities[product_id]
+        for reservation_id, reserved_product, quantity in reserved:
+            if reserved_product == product_id and _claim(db, reservation_id):
+                needed -= quantity
+        if needed < 0:
+            _give_back(db, product_id, -needed)
+        elif needed > 0 and not take_stock(db, product_id, needed):
+            db.rollback()
+            raise OutOfStock([product_id])
+
+def restock(db: Session, quantities: dict):
+    """Return an order's {product_id: quantity} to stock; the caller commits."""
+    for product_id in sorted(quantities):
+        _give_back(db, product_id, quantities[product_id])
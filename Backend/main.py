@@ -1,13 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, status, Request, Response, UploadFile, File
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
 from typing import List
-import crud, models, schemas, auth, database
+from contextlib import asynccontextmanager
+from datetime import date
+import hmac
+import io
+import crud, models, schemas, analytics, auth, compression, database, importer, inventory, metrics, payments, responses, search
+from cache import catalog_cache
 
-models.Base.metadata.create_all(bind=database.engine)
+# The schema is created and migrated once per deploy by `python manage.py
+# init-db`, not by every worker at import. AUTO_CREATE_SCHEMA=true brings back
+# create_all on startup for throwaway local databases.
+if database.env_flag("AUTO_CREATE_SCHEMA"):
+    models.Base.metadata.create_all(bind=database.engine)
 
-app = FastAPI()
+for db_engine in database.all_engines():
+    metrics.instrument_engine(db_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    payments.start_workers()
+    analytics.start_folding()
+    yield
+    analytics.stop_folding()
+    payments.stop_workers()
+    auth.shutdown_hashing()
+
+app = FastAPI(lifespan=lifespan, default_response_class=responses.FastJSONResponse)
+
+if database.DB_ASYNC:
+    # Registered first, so these async handlers take precedence over the sync
+    # handlers for the same paths declared below.
+    import async_routes
+    app.include_router(async_routes.router)
 
 # CORS configuration
 import os
@@ -28,88 +56,170 @@ app.add_middleware(
     allow_credentials=True if "*" not in raw_origins else False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Location", "X-Last-Write"],
 )
 
+app.add_middleware(compression.CompressionMiddleware)
+
+# Added last so it is outermost and its timings include the other middleware.
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+
+@app.exception_handler(auth.HashingBusy)
+def hashing_busy_handler(request: Request, exc: auth.HashingBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication service is busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "TechShop API is running"}
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Probes for the orchestrator: /healthz says the process is serving (restart it
+# if not), /readyz that it can reach the primary database (route traffic to it).
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    error = database.check_database()
+    if error is not None:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "database": error})
+    return {"status": "ok", "database": "ok"}
+
+# Shared with auth.get_current_user so a request opens a single session.
+get_db = database.get_db
+# Read-only handlers: a replica session when DATABASE_REPLICA_URLS is set,
+# shared with auth.get_current_user_read.
+get_read_db = auth.get_read_db
 
 # Auth Routes
 @app.post("/auth/register", response_model=schemas.Token)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def register(user: schemas.UserCreate, response: Response, db: Session = Depends(get_db)):
     db_user = crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     user = crud.create_user(db=db, user=user)
+    auth.mark_write(response, user.email)
     access_token = auth.create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=schemas.Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     user = crud.get_user_by_email(db, form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = auth.verify_and_update_password(form_data.password, user.hashed_password) if user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        crud.update_password_hash(db, user, new_hash)
     access_token = auth.create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=schemas.User)
-def read_user_me(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-    email: str = payload.get("sub")
-    user = crud.get_user_by_email(db, email=email)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+def read_user_me(current_user: schemas.User = Depends(auth.get_current_user_read)):
+    return current_user
 
 @app.put("/auth/me", response_model=schemas.User)
-def update_user_me(user_update: schemas.UserUpdate, token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-    email: str = payload.get("sub")
-    db_user = crud.get_user_by_email(db, email=email)
+def update_user_me(user_update: schemas.UserUpdate, response: Response, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    db_user = crud.get_user(db, user_id=current_user.id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    return crud.update_user(db, db_user, user_update)
+    db_user = crud.update_user(db, db_user, user_update)
+    auth.mark_write(response, db_user.email)
+    return db_user
 
 @app.get("/auth/me/activity", response_model=schemas.UserActivity)
-def read_user_activity(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-    email: str = payload.get("sub")
-    user = crud.get_user_by_email(db, email=email)
-    if not user:
+def read_user_activity(current_user: schemas.User = Depends(auth.get_current_user_read), db: Session = Depends(get_read_db)):
+    activity = crud.get_user_activity(db, user_id=current_user.id)
+    if activity is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    orders = crud.get_user_orders(db, user_id=user.id)
     return {
-        "total_orders": len(orders),
-        "last_order_date": orders[0].created_at if orders else None,
-        "account_created": datetime.min # Placeholder if we don't have created_at in User
+        "total_orders": activity.order_count or 0,
+        "total_spent": activity.total_spent or 0,
+        "first_order_date": activity.first_order_at,
+        "last_order_date": activity.last_order_at,
+        "account_created": activity.created_at,
     }
 
 @app.get("/orders/me", response_model=List[schemas.Order])
-def read_orders_me(token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-    email: str = payload.get("sub")
-    user = crud.get_user_by_email(db, email=email)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return crud.get_user_orders(db, user_id=user.id)
+def read_orders_me(response: Response, limit: int = 50, cursor: str = None, current_user: schemas.User = Depends(auth.get_current_user_read), db: Session = Depends(get_read_db)):
+    try:
+        orders = crud.get_user_orders(db, user_id=current_user.id, limit=limit, cursor=cursor)
+    except crud.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if orders and len(orders) == limit:
+        response.headers["X-Next-Cursor"] = crud.order_cursor(orders[-1])
+    return orders
+
+@app.get("/cache/stats")
+def read_cache_stats(admin: schemas.User = Depends(auth.get_current_admin)):
+    return {
+        "catalog": catalog_cache.stats(),
+        "users": auth.user_cache.stats(),
+        "tokens": auth.token_cache.stats(),
+        "password_hashing": auth.hashing_stats(),
+        "payments": payments.worker_stats(),
+        "read_replicas": database.replica_stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics(authorization: str = Header(None)):
+    # Internal state: only served to scrapers holding METRICS_TOKEN.
+    if not metrics.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest((authorization or "").encode(), f"Bearer {metrics.METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    caches = {"catalog": catalog_cache, "users": auth.user_cache, "tokens": auth.token_cache}
+    hashing = auth.hashing_stats()
+    samples = list(metrics.cache_samples(caches))
+    samples.append((("password_hash_jobs_in_flight", ()), hashing["in_flight"]))
+    return PlainTextResponse(metrics.registry.render(samples), media_type="text/plain; version=0.0.4")
 
 # Product Routes
 @app.get("/products", response_model=List[schemas.Product])
-def read_products(category: str = None, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    products = crud.get_products(db, skip=skip, limit=limit, category=category)
-    return products
+def read_products(request: Request, category: str = None, skip: int = 0, limit: int = 100,
+                  sort: str = "id", cursor: str = None, fields: str = None, db: Session = Depends(get_read_db)):
+    # The listing is served from already-serialized (and compressed) bodies; a
+    # matching If-None-Match is answered with a 304 without touching the database.
+    # Pass the X-Next-Cursor header back as `cursor` to fetch the next page, and
+    # e.g. fields=id,name,price to receive only those columns.
+    try:
+        fields = crud.parse_product_fields(fields)
+    except crud.InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    key = (category, skip, limit, sort, cursor, fields)
+    entry = catalog_cache.get(key)
+    if entry is None:
+        version = catalog_cache.version
+        try:
+            products = crud.get_products(db, skip=skip, limit=limit, category=category, sort=sort, cursor=cursor, fields=fields)
+        except crud.InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        entry = responses.cache_product_page(key, products, limit, sort, version, fields)
+    return responses.catalog_response(entry, request.headers.get("if-none-match"), request.headers.get("accept-encoding"))
+
+@app.get("/products/search", response_model=schemas.ProductSearchResult)
+def search_products(q: str, category: str = None, limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                    db: Session = Depends(get_read_db)):
+    products, total, facets = search.search_products(db, q, category=category, limit=limit, offset=offset)
+    return responses.FastJSONResponse({"items": responses.product_dicts(products), "total": total, "facets": facets})
+
+@app.post("/products/import", response_model=schemas.ProductImportReport)
+def import_products(file: UploadFile = File(...), format: str = None,
+                    admin: schemas.User = Depends(auth.get_current_admin), db: Session = Depends(get_db)):
+    # NDJSON (one product per line) or CSV with a header row; format defaults
+    # from the file extension. The upload is spooled to disk, not memory.
+    fmt = format or importer.detect_format(file.filename)
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    stream = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
+    return importer.import_products(db, importer.iter_rows(stream, fmt)).dict()
 
 @app.post("/products", response_model=schemas.Product)
 def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
@@ -117,25 +227,98 @@ def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)
 
 # Order Routes
 @app.post("/orders", response_model=schemas.Order)
-def create_order(order: schemas.OrderCreate, token: str = Depends(auth.oauth2_scheme), db: Session = Depends(get_db)):
-    # Verify user
+def create_order(order: schemas.OrderCreate, response: Response, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
     try:
-        payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        email: str = payload.get("sub")
-    except auth.JWTError:
-        raise HTTPException(status_code=401, detail="Could not validate credentials")
-    
-    user = crud.get_user_by_email(db, email=email)
-    if not user:
-         raise HTTPException(status_code=401, detail="User not found")
+        db_order = crud.create_order(db=db, order=order, user_id=current_user.id)
+    except crud.UnknownProducts as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except inventory.OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # The user's next reads (orders, activity) must see this order.
+    auth.mark_write(response, current_user.email)
+    return db_order
+
+@app.post("/orders/{order_id}/cancel", response_model=schemas.Order)
+def cancel_order(order_id: int, response: Response, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    try:
+        db_order = crud.cancel_order(db, order_id=order_id, user_id=current_user.id)
+    except crud.OrderNotCancellable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if db_order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    auth.mark_write(response, current_user.email)
+    return db_order
+
+# Reservation Routes
+@app.post("/reservations", response_model=schemas.Reservation, status_code=201)
+def create_reservation(reservation: schemas.ReservationCreate, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    # Holds stock for RESERVATION_TTL seconds; POST /orders by the same user consumes it.
+    if crud.get_product(db, reservation.product_id) is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    try:
+        return inventory.reserve(db, current_user.id, reservation.product_id, reservation.quantity)
+    except inventory.OutOfStock as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    return crud.create_order(db=db, order=order, user_id=user.id)
+@app.delete("/reservations/{reservation_id}", status_code=204)
+def delete_reservation(reservation_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    if not inventory.release(db, current_user.id, reservation_id):
+        raise HTTPException(status_code=404, detail="Reservation not found")
+    return Response(status_code=204)
 
-# Payment Route
-@app.post("/payments", status_code=200)
-def process_payment(payment: schemas.PaymentCreate):
-    # Mock payment processing
-    return {"status": "coming_soon", "message": "Payment gateway integration coming soon", "data": payment}
+# Payment Routes
+@app.post("/payments", response_model=schemas.Payment, status_code=202)
+def process_payment(payment: schemas.PaymentCreate, response: Response, idempotency_key: str = Header(None),
+                    current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    # Accepted for background processing (see payments.py); poll the Location
+    # until status is "success" or "failed". Retries with the same
+    # Idempotency-Key header return the original payment.
+    try:
+        db_payment = payments.enqueue(db, current_user.id, payment, idempotency_key)
+    except payments.InvalidPayment as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except payments.OrderNotPayable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except payments.PaymentsDisabled as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if db_payment is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    auth.mark_write(response, current_user.email)
+    response.headers["Location"] = f"/payments/{db_payment.id}"
+    return payments.payment_status(db_payment)
+
+@app.get("/payments/{payment_id}", response_model=schemas.Payment)
+def read_payment(payment_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(get_db)):
+    db_payment = payments.get_payment(db, payment_id, current_user.id)
+    if db_payment is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return payments.payment_status(db_payment)
+
+# Analytics Routes (admin only). Served from the daily rollup tables; start and
+# end are inclusive dates and default to the last 7 days.
+@app.get("/admin/analytics/categories", response_model=List[schemas.CategorySales])
+def read_category_sales(start: date = None, end: date = None, category: str = None,
+                        admin: schemas.User = Depends(auth.get_current_admin), db: Session = Depends(get_read_db)):
+    try:
+        return analytics.category_sales(db, start, end, category=category)
+    except analytics.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/analytics/products/top", response_model=List[schemas.ProductSales])
+def read_top_products(start: date = None, end: date = None, limit: int = 10, category: str = None, sort: str = "revenue",
+                      admin: schemas.User = Depends(auth.get_current_admin), db: Session = Depends(get_read_db)):
+    try:
+        return analytics.top_products(db, start, end, limit=limit, category=category, sort=sort)
+    except analytics.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/analytics/products/{product_id}", response_model=List[schemas.ProductSalesDay])
+def read_product_sales(product_id: int, start: date = None, end: date = None,
+                       admin: schemas.User = Depends(auth.get_current_admin), db: Session = Depends(get_read_db)):
+    try:
+        return analytics.product_sales(db, product_id, start, end)
+    except analytics.InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # Seed Data Endpoint (For development convenience)
 @app.post("/seed_products")
@@ -143,6 +326,7 @@ def seed_products(db: Session = Depends(get_db)):
     # Clear existing products to ensure clean categories
     db.query(models.Product).delete()
     db.commit()
+    catalog_cache.bump()
     
     mock_products = [
         # Laptops & Work (8)
@@ -176,17 +360,16 @@ def seed_products(db: Session = Depends(get_db)):
         {"name": "Micrófono Shure SM7B", "price": 399.99, "image": "https://images.unsplash.com/photo-1590602847861-f357a9332bbc?auto=format&fit=crop&w=800&q=80", "description": "El estándar de la industria del podcasting", "category": "Premium Audio"},
 
         # Ultimate Gaming (8)
-        {"name": "RTX 4090 Founders Edition", "price": 1599.99, "image": "https://images.unsplash.com/photo-1591488320449-011701bb6704?auto=format&fit=crop&w=800&q=80", "description": "La cúspide del rendimiento gaming", "category": "Ultimate Gaming"},
+        {"name": "RTX 4090 Founders Edition", "price": 1599.99, "stock": 25, "image": "https://images.unsplash.com/photo-1591488320449-011701bb6704?auto=format&fit=crop&w=800&q=80", "description": "La cúspide del rendimiento gaming", "category": "Ultimate Gaming"},
         {"name": "Razer BlackWidow V4", "price": 229.99, "image": "https://images.unsplash.com/photo-1612198188060-c7c2a3b66eae?auto=format&fit=crop&w=800&q=80", "description": "Inmersión total con RGB", "category": "Ultimate Gaming"},
         {"name": "Logitech G Pro X Superlight", "price": 159.99, "image": "https://images.unsplash.com/photo-1660491083562-d91a64d6ea9c?auto=format&fit=crop&w=800&q=80", "description": "El ratón más ligero de los eSports", "category": "Ultimate Gaming"},
         {"name": "Monitor Samsung Odyssey G9", "price": 1299.99, "image": "https://images.unsplash.com/photo-1616763355548-1b606f439f86?auto=format&fit=crop&w=800&q=80", "description": "49 pulgadas de pura adrenalina", "category": "Ultimate Gaming"},
         {"name": "Auriculares SteelSeries Arctis", "price": 349.99, "image": "https://m.media-amazon.com/images/I/61+WSjGgFzL._AC_SL1500_.jpg", "description": "Sonido envolvente para ganar", "category": "Ultimate Gaming"},
         {"name": "Silla Herman Miller Embody", "price": 1799.99, "image": "https://m.media-amazon.com/images/I/81vXeRdDeNL._AC_SY300_SX300_QL70_FMwebp_.jpg", "description": "Ergonomía extrema para sesiones largas", "category": "Ultimate Gaming"},
-        {"name": "Consola PlayStation 5 Slim", "price": 499.99, "image": "https://images.unsplash.com/photo-1606144042614-b2417e99c4e3?auto=format&fit=crop&w=800&q=80", "description": "El futuro del gaming ya está aquí", "category": "Ultimate Gaming"},
+        {"name": "Consola PlayStation 5 Slim", "price": 499.99, "stock": 50, "image": "https://images.unsplash.com/photo-1606144042614-b2417e99c4e3?auto=format&fit=crop&w=800&q=80", "description": "El futuro del gaming ya está aquí", "category": "Ultimate Gaming"},
         {"name": "Mando Xbox Elite Series 2", "price": 179.99, "image": "https://m.media-amazon.com/images/I/717XTm0moDL._SL1500_.jpg", "description": "El mando definitivo para ganar", "category": "Ultimate Gaming"}
     ]
 
-    for p in mock_products:
-        crud.create_product(db, schemas.ProductCreate(**p))
+    importer.import_products(db, enumerate(mock_products, start=1))
     
     return {"message": "Data seeded successfully"}
@@ -0,0 +1,126 @@
+"""Operational commands for the TechShop API.
+
+    python manage.py init-db
+    python manage.py import-products catalog.ndjson
+    python manage.py import-products - --format csv < catalog.csv
+    python manage.py backfill-user-stats
+    python manage.py rebuild-analytics --start 2024-01-01 --end 2024-12-31
+    python manage.py fold-analytics
+    PAYMENT_WORKERS=0 uvicorn main:app & python manage.py process-payments --workers 8
+"""
+import argparse
+import json
+from datetime import date
+import os
+import sys
+import time
+import analytics, crud, database, importer, models, payments
+
+SCHEMA_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "BD", "TABS.sql")
+
+def init_db(args):
+    # Run once per deploy, before the API workers start. On PostgreSQL the
+    # idempotent BD/TABS.sql also migrates existing tables (added columns and
+    # indexes); create_all then adds anything it doesn't cover, and is all
+    # there is for SQLite.
+    if database.engine.url.get_backend_name() == "postgresql" and args.sql:
+        with open(args.sql, encoding="utf-8") as f, database.engine.begin() as conn:
+            conn.exec_driver_sql(f.read())
+    models.Base.metadata.create_all(bind=database.engine)
+    print(f"Schema is up to date on {database.engine.url.render_as_string(hide_password=True)}")
+    return 0
+
+def import_products(args):
+    fmt = args.format or importer.detect_format(args.path)
+    if args.path == "-":
+        stream = open(sys.stdin.fileno(), encoding="utf-8", newline="", closefd=False)
+    else:
+        stream = open(args.path, encoding="utf-8", newline="")
+    db = database.SessionLocal()
+    try:
+        with stream:
+            report = importer.import_products(db, importer.iter_rows(stream, fmt), batch_size=args.batch_size)
+    finally:
+        db.close()
+    json.dump(report.dict(), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if report.failed else 0
+
+def backfill_user_stats(args):
+    db = database.SessionLocal()
+    try:
+        users = crud.backfill_user_stats(db)
+    finally:
+        db.close()
+    print(f"Rebuilt order statistics for {users} users")
+    return 0
+
+def rebuild_analytics(args):
+    db = database.SessionLocal()
+    try:
+        counts = analytics.rebuild(db, start=args.start, end=args.end)
+    finally:
+        db.close()
+    print(f"Rebuilt sales rollups: {counts['product_days']} product days, {counts['category_days']} category days")
+    return 0
+
+def fold_analytics(args):
+    # What each API process does every ANALYTICS_FOLD_INTERVAL seconds, e.g.
+    # from cron with ANALYTICS_FOLD_INTERVAL=0 in the API processes.
+    db = database.SessionLocal()
+    try:
+        folded = analytics.fold_pending(db)
+    finally:
+        db.close()
+    print(f"Folded {folded} pending sales changes into the rollups")
+    return 0
+
+def process_payments(args):
+    # Payment workers outside the API processes, e.g. with PAYMENT_WORKERS=0 there.
+    if payments.payment_gateway is None:
+        print("PAYMENT_GATEWAY is not set; nothing to process payments with", file=sys.stderr)
+        return 1
+    payments.start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        payments.stop_workers()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TechShop API management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("init-db", help="create or migrate the database schema")
+    cmd.add_argument("--sql", default=SCHEMA_SQL, help="schema script for PostgreSQL; empty to only run create_all")
+    cmd.set_defaults(handler=init_db)
+
+    cmd = commands.add_parser("import-products", help="bulk import products from NDJSON or CSV")
+    cmd.add_argument("path", help="input file, or - for stdin")
+    cmd.add_argument("--format", choices=("ndjson", "csv"), help="defaults from the file extension")
+    cmd.add_argument("--batch-size", type=int, default=importer.IMPORT_BATCH_SIZE)
+    cmd.set_defaults(handler=import_products)
+
+    cmd = commands.add_parser("backfill-user-stats", help="rebuild per-user order statistics from existing orders")
+    cmd.set_defaults(handler=backfill_user_stats)
+
+    cmd = commands.add_parser("rebuild-analytics", help="recompute the daily sales rollups from orders")
+    cmd.add_argument("--start", type=date.fromisoformat, help="first day to rebuild (YYYY-MM-DD); default: all history")
+    cmd.add_argument("--end", type=date.fromisoformat, help="last day to rebuild, inclusive")
+    cmd.set_defaults(handler=rebuild_analytics)
+
+    cmd = commands.add_parser("fold-analytics", help="move pending sales changes into the daily rollups")
+    cmd.set_defaults(handler=fold_analytics)
+
+    cmd = commands.add_parser("process-payments", help="run payment workers until interrupted")
+    cmd.add_argument("--workers", type=int, default=max(payments.PAYMENT_WORKERS, 1))
+    cmd.set_defaults(handler=process_payments)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Per-request performance instrumentation, exposed at GET /metrics in the
+# Prometheus text format to scrapers sending `Authorization: Bearer
+# $METRICS_TOKEN`.
+#
+# MetricsMiddleware times every request and opens a RequestStats for it; the
+# SQLAlchemy hooks installed by instrument_engine() add each statement's count
+# and duration to the stats of the request that issued it. Requests issuing
+# more than N_PLUS_ONE_THRESHOLD statements are counted and logged as likely
+# N+1 patterns, and statements slower than SLOW_QUERY_MS are logged with the
+# route that ran them.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "20"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "") # Bearer token for GET /metrics; unset disables it
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger("techshop.metrics")
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # Callers hold the registry lock.
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}  # (name, labels) -> value
+        self.help = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        self.help[name] = (kind, text)
+
+    def observe(self, name: str, labels: tuple, value: float, buckets):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        with self._lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def render(self, extra_samples=()) -> str:
+        lines = []
+        with self._lock:
+            samples = sorted(self.counters.items()) + list(extra_samples)
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            by_name = {}
+            for (name, labels), value in samples:
+                by_name.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+            for (name, labels), histogram in histograms:
+                out = by_name.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    out.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                out.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+                out.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for name in sorted(by_name):
+            if name in self.help:
+                kind, text = self.help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            lines.extend(by_name[name])
+        return "\n".join(lines) + "\n"
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = Registry()
+registry.describe("http_request_duration_seconds", "histogram", "Request latency by route.")
+registry.describe("http_request_db_seconds", "histogram", "Database time spent per request.")
+registry.describe("http_request_sql_statements", "histogram", "SQL statements executed per request.")
+registry.describe("http_requests_n_plus_one_total", "counter", f"Requests issuing more than {N_PLUS_ONE_THRESHOLD} SQL statements.")
+registry.describe("db_slow_queries_total", "counter", f"SQL statements slower than {SLOW_QUERY_MS:g} ms.")
+registry.describe("db_failed_queries_total", "counter", "SQL statements that raised an error.")
+
+class RequestStats:
+    __slots__ = ("scope", "router", "statements", "db_seconds")
+
+    def __init__(self, scope, router):
+        self.scope = scope
+        self.router = router
+        self.statements = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # Resolved on demand: routing happens inside the app, after the stats are opened.
+        return _route_path(self.router, self.scope)
+
+_current = ContextVar("request_stats", default=None)
+
+def _route_path(app, scope) -> str:
+    route = scope.get("route")
+    if route is None:
+        # Older Starlette versions don't record the matched route in the scope.
+        for candidate in getattr(app, "routes", ()):
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", "unmatched")
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so it adds no per-request task or body buffering."""
+
+    def __init__(self, app, router=None):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope, self.router)
+        token = _current.set(stats)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            record_request(scope["method"], stats, status[0], elapsed)
+
+def record_request(method: str, stats: RequestStats, status: int, elapsed: float):
+    path = stats.route
+    route = (("route", path),)
+    registry.observe("http_request_duration_seconds", (("method", method),) + route + (("status", status),), elapsed, LATENCY_BUCKETS)
+    registry.observe("http_request_db_seconds", route, stats.db_seconds, LATENCY_BUCKETS)
+    registry.observe("http_request_sql_statements", route, stats.statements, STATEMENT_BUCKETS)
+    if stats.statements > N_PLUS_ONE_THRESHOLD:
+        registry.inc("http_requests_n_plus_one_total", route)
+        logger.warning("Possible N+1: %s %s issued %d SQL statements", method, path, stats.statements)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, so a statement that raises leaves nothing behind.
+    context._query_start = time.perf_counter()
+
+def _record_statement(context, statement: str):
+    elapsed = time.perf_counter() - context._query_start
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "-"
+        registry.inc("db_slow_queries_total", ())
+        logger.warning("Slow query (%.1f ms) during %s: %s", elapsed * 1000, route, " ".join(statement.split())[:500])
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_statement(context, statement)
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    if context is None or not hasattr(context, "_query_start"):
+        return  # Failed before the statement was sent (e.g. while connecting)
+    registry.inc("db_failed_queries_total", ())
+    _record_statement(context, exception_context.statement or "")
+
+def instrument_engine(engine):
+    engine = getattr(engine, "sync_engine", engine)  # AsyncEngine wraps a sync one
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def cache_samples(caches: dict):
+    """Expose TTLCache statistics alongside the request metrics."""
+    for name, cache in caches.items():
+        stats = cache.stats()
+        labels = (("cache", name),)
+        yield ("cache_hits_total", labels), stats["hits"]
+        yield ("cache_misses_total", labels), stats["misses"]
+        yield ("cache_entries", labels), stats["size"]
+
+registry.describe("cache_hits_total", "counter", "In-process cache hits.")
+registry.describe("cache_misses_total", "counter", "In-process cache misses.")
+registry.describe("cache_entries", "gauge", "Entries currently held by an in-process cache.")
+registry.describe("password_hash_jobs_in_flight", "gauge", "Password hashing jobs running or queued.")
@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime
+from sqlalchemy import Boolean, CheckConstraint, Column, ForeignKey, Integer, String, Float, Date, DateTime, Index, UniqueConstraint, func, literal_column
+from sqlalchemy.dialects import postgresql  # registers the to_tsvector()/setweight() types
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -10,18 +11,70 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     name = Column(String)
     hashed_password = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
     orders = relationship("Order", back_populates="owner")
+    stats = relationship("UserStats", uselist=False)
+
+class UserStats(Base):
+    # Per-user order aggregates, updated in the same transaction as each new
+    # order (crud.create_order) so GET /auth/me/activity is a single-row read.
+    # `manage.py backfill-user-stats` rebuilds them from the orders table.
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    order_count = Column(Integer, nullable=False, default=0)
+    total_spent = Column(Float, nullable=False, default=0)
+    first_order_at = Column(DateTime)
+    last_order_at = Column(DateTime)
+
+def search_document(name, category, description):
+    def weighted(column, weight):
+        return func.setweight(func.to_tsvector(literal_column("'simple'"), func.coalesce(column, literal_column("''"))), literal_column(f"'{weight}'"))
+    return weighted(name, "A").op("||")(weighted(category, "B")).op("||")(weighted(description, "C"))
 
 class Product(Base):
     __tablename__ = "products"
 
     id = Column(Integer, primary_key=True, index=True)
+    sku = Column(String, unique=True, index=True, nullable=True) # Natural key for bulk imports
     name = Column(String, index=True)
     price = Column(Float)
     description = Column(String)
     image = Column(String)
     category = Column(String)
+    stock = Column(Integer, nullable=True) # Units available to sell; NULL means not tracked (see inventory.py)
+
+    # Keyset pagination indexes: one per (filter, sort) combination served by
+    # crud.get_products, always ending in id as the tie-breaker.
+    __table_args__ = (
+        Index("ix_products_category_id", "category", "id"),
+        Index("ix_products_category_price_id", "category", "price", "id"),
+        Index("ix_products_category_name_id", "category", "name", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_search", search_document(name, category, description), postgresql_using="gin").ddl_if(dialect="postgresql"),
+        CheckConstraint("stock IS NULL OR stock >= 0", name="ck_products_stock_non_negative"),
+    )
+
+# Full-text document for search.py; queries must use this exact expression for
+# Postgres to pick the GIN index. Other databases use the in-process index.
+product_search_vector = search_document(Product.name, Product.category, Product.description)
+
+class StockReservation(Base):
+    # Stock held for a user's checkout until expires_at; see inventory.py.
+    __tablename__ = "stock_reservations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_stock_reservations_user_id_product_id", "user_id", "product_id"),
+        Index("ix_stock_reservations_product_id_expires_at", "product_id", "expires_at"),
+    )
 
 class Order(Base):
     __tablename__ = "orders"
@@ -34,13 +87,18 @@ class Order(Base):
 
     owner = relationship("User", back_populates="orders")
     items = relationship("OrderItem", back_populates="order")
-    payment = relationship("Payment", back_populates="order", uselist=False)
+    payments = relationship("Payment", back_populates="order") # A failed payment can be retried with a new one
+
+    __table_args__ = (
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        Index("ix_orders_created_at", "created_at"), # Date-range rebuilds of the sales rollups
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
     price = Column(Float) # Store price at time of purchase
@@ -48,13 +106,96 @@ class OrderItem(Base):
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
 
+    @property
+    def product_name(self):
+        return self.product.name if self.product else None
+
+    @property
+    def product_image(self):
+        return self.product.image if self.product else None
+
+class DailyProductSales(Base):
+    # Sales rollups for the admin analytics endpoints, folded in from
+    # sales_deltas in the background (see analytics.py).
+    # `manage.py rebuild-analytics` recomputes them from orders and order_items.
+    __tablename__ = "daily_product_sales"
+
+    day = Column(Date, primary_key=True) # UTC date of the order
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    category = Column(String) # Product category when the order was placed
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_daily_product_sales_product_id_day", "product_id", "day"),
+    )
+
+class DailyCategorySales(Base):
+    __tablename__ = "daily_category_sales"
+
+    day = Column(Date, primary_key=True)
+    category = Column(String, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_daily_category_sales_category_day", "category", "day"),
+    )
+
+class SalesDelta(Base):
+    # Append-only changes to the sales rollups: each order and cancellation
+    # inserts its rows here, in its own transaction, instead of updating the
+    # shared rollup rows. analytics.fold moves them into the rollups.
+    __tablename__ = "sales_deltas"
+
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    day = Column(Date, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True) # NULL for the per-category rows
+    category = Column(String)
+    orders = Column(Integer, nullable=False)
+    units = Column(Integer, nullable=False)
+    revenue = Column(Float, nullable=False)
+
 class Payment(Base):
     __tablename__ = "payments"
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
     amount = Column(Float)
     status = Column(String) # e.g., "success", "failed", "pending"
     provider = Column(String, default="manual") # For future gateway integration
+    idempotency_key = Column(String, nullable=True) # Client-supplied Idempotency-Key header
+    gateway_reference = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    order = relationship("Order", back_populates="payments")
+    job = relationship("PaymentJob", back_populates="payment", uselist=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_key", name="uq_payments_user_id_idempotency_key"),
+    )
+
+class PaymentJob(Base):
+    # Durable outbox for payments.py: one row per payment, claimed by a worker
+    # under a lease and retried with backoff until it succeeds or gives up.
+    __tablename__ = "payment_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    payment_id = Column(Integer, ForeignKey("payments.id"), unique=True, nullable=False)
+    status = Column(String, nullable=False, default="queued") # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow) # Next attempt not before
+    locked_until = Column(DateTime, nullable=True) # Lease of the worker running it
+    last_error = Column(String, nullable=True)
+
+    payment = relationship("Payment", back_populates="job")
 
-    order = relationship("Order", back_populates="payment")
+    __table_args__ = (
+        Index("ix_payment_jobs_status_run_at", "status", "run_at"),
+    )
@@ -0,0 +1,255 @@
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import database, gateway, models, schemas
+
+# Asynchronous payment processing.
+#
+# POST /payments only writes a Payment and its PaymentJob (the outbox) in the
+# same transaction as moving the order to "payment_pending", and returns 202.
+# Background worker threads claim due jobs under a lease (SKIP LOCKED on
+# Postgres, a conditional UPDATE elsewhere), call the gateway, and record the
+# outcome: the payment becomes "success" or "failed" and the order "paid" or
+# back to "pending". Transient gateway errors are retried with exponential
+# backoff up to PAYMENT_MAX_ATTEMPTS. Every attempt for a payment sends the same
+# gateway idempotency key, so a retry after a crash can't charge twice.
+#
+# With no PAYMENT_GATEWAY configured (see gateway.py) no workers start and
+# enqueue raises PaymentsDisabled, which the API returns as 503.
+
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "2")) # Per process; 0 disables
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", "5"))
+PAYMENT_BACKOFF = float(os.getenv("PAYMENT_BACKOFF", "1")) # Seconds before the first retry, doubled each time
+PAYMENT_BACKOFF_MAX = float(os.getenv("PAYMENT_BACKOFF_MAX", "60"))
+PAYMENT_LEASE = float(os.getenv("PAYMENT_LEASE", "30")) # A running job not finished by then is claimable again
+PAYMENT_POLL_INTERVAL = float(os.getenv("PAYMENT_POLL_INTERVAL", "1"))
+
+logger = logging.getLogger("techshop.payments")
+
+payment_gateway = gateway.from_env()
+
+class PaymentsDisabled(RuntimeError):
+    pass
+
+class InvalidPayment(ValueError):
+    pass
+
+class OrderNotPayable(ValueError):
+    pass
+
+def payment_status(payment: models.Payment) -> dict:
+    return {
+        "id": payment.id,
+        "order_id": payment.order_id,
+        "amount": payment.amount,
+        "status": payment.status,
+        "provider": payment.provider,
+        "attempts": payment.job.attempts if payment.job else 0,
+        "error": payment.error,
+        "created_at": payment.created_at,
+        "updated_at": payment.updated_at,
+    }
+
+def get_payment(db: Session, payment_id: int, user_id: int):
+    return db.query(models.Payment).filter(models.Payment.id == payment_id, models.Payment.user_id == user_id).first()
+
+def _find_by_key(db: Session, user_id: int, idempotency_key: str, payment: schemas.PaymentCreate):
+    existing = db.query(models.Payment).filter(
+        models.Payment.user_id == user_id, models.Payment.idempotency_key == idempotency_key
+    ).first()
+    if existing is not None and existing.order_id != payment.order_id:
+        raise InvalidPayment("Idempotency-Key was already used for a different order")
+    return existing
+
+def enqueue(db: Session, user_id: int, payment: schemas.PaymentCreate, idempotency_key: str = None):
+    """Accept a payment for processing; returns None if the user has no such order.
+
+    Repeating a request with the same Idempotency-Key returns the original payment.
+    """
+    if payment_gateway is None:
+        raise PaymentsDisabled("Payments are not available: no payment gateway is configured")
+    if idempotency_key:
+        existing = _find_by_key(db, user_id, idempotency_key, payment)
+        if existing is not None:
+            return existing
+    db_order = db.query(models.Order).filter(models.Order.id == payment.order_id, models.Order.user_id == user_id).first()
+    if db_order is None:
+        return None
+    if abs(payment.amount - db_order.total_price) > 0.005:
+        raise InvalidPayment(f"Amount does not match the order total of {db_order.total_price:.2f}")
+    order = models.Order
+    claimed = db.execute(
+        update(order).where(order.id == db_order.id, order.status == "pending")
+        .values(status="payment_pending").execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        # A concurrent request with the same key may have claimed the order first.
+        existing = _find_by_key(db, user_id, idempotency_key, payment) if idempotency_key else None
+        if existing is not None:
+            return existing
+        db.refresh(db_order)
+        raise OrderNotPayable(f"Order is {db_order.status} and cannot be paid")
+    db_payment = models.Payment(
+        order_id=db_order.id,
+        user_id=user_id,
+        amount=db_order.total_price,
+        status="pending",
+        provider=payment_gateway.name,
+        idempotency_key=idempotency_key,
+    )
+    db_payment.job = models.PaymentJob(status="queued", run_at=datetime.utcnow())
+    db.add(db_payment)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = _find_by_key(db, user_id, idempotency_key, payment) if idempotency_key else None
+        if existing is None:
+            raise
+        return existing
+    _wake.set()
+    db.refresh(db_payment)
+    return db_payment
+
+# Workers
+
+_stop = threading.Event()
+_wake = threading.Event()
+_workers = []
+
+def _claimable(now: datetime):
+    job = models.PaymentJob
+    return or_(
+        and_(job.status == "queued", job.run_at <= now),
+        and_(job.status == "running", job.locked_until < now),
+    )
+
+def claim(db: Session):
+    """Lease the next due job; returns (job id, attempt number) or None."""
+    job = models.PaymentJob
+    now = datetime.utcnow()
+    query = select(job.id, job.attempts).where(_claimable(now)).order_by(job.run_at)
+    if db.bind.dialect.name == "postgresql":
+        query = query.limit(1).with_for_update(skip_locked=True)
+    else:
+        query = query.limit(10)
+    for job_id, attempts in db.execute(query).all():
+        # attempts doubles as a fencing token: only the claimant of this attempt may record its outcome.
+        claimed = db.execute(
+            update(job).where(job.id == job_id, job.attempts == attempts, _claimable(now))
+            .values(status="running", attempts=attempts + 1, locked_until=now + timedelta(seconds=PAYMENT_LEASE))
+        ).rowcount
+        if claimed:
+            db.commit()
+            return job_id, attempts + 1
+    db.rollback()
+    return None
+
+def _backoff(attempt: int) -> float:
+    delay = min(PAYMENT_BACKOFF_MAX, PAYMENT_BACKOFF * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def _finish_job(db: Session, job_id: int, attempt: int, **values) -> bool:
+    job = models.PaymentJob
+    return db.execute(
+        update(job).where(job.id == job_id, job.status == "running", job.attempts == attempt)
+        .values(locked_until=None, **values)
+    ).rowcount == 1
+
+def _record(db: Session, job_id: int, attempt: int, payment, reference: str = None, error: str = None):
+    payment_id, order_id = payment
+    if not _finish_job(db, job_id, attempt, status="done" if error is None else "failed", last_error=error):
+        # Lease expired and another worker took the job over; it will record the outcome.
+        db.rollback()
+        return
+    db.execute(
+        update(models.Payment).where(models.Payment.id == payment_id).values(
+            status="success" if error is None else "failed", gateway_reference=reference, error=error
+        )
+    )
+    order = models.Order
+    db.execute(
+        update(order).where(order.id == order_id, order.status == "payment_pending")
+        .values(status="paid" if error is None else "pending")
+    )
+    db.commit()
+
+def process(db: Session, job_id: int, attempt: int):
+    payment_id, order_id, amount = db.execute(
+        select(models.Payment.id, models.Payment.order_id, models.Payment.amount)
+        .join(models.PaymentJob).where(models.PaymentJob.id == job_id)
+    ).one()
+    db.rollback()  # Don't hold a transaction open across the gateway call
+    payment = (payment_id, order_id)
+    try:
+        reference = payment_gateway.charge(amount, idempotency_key=f"payment-{payment_id}")
+    except gateway.PaymentDeclined as e:
+        _record(db, job_id, attempt, payment, error=str(e))
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        if attempt >= PAYMENT_MAX_ATTEMPTS:
+            logger.warning("Payment %s failed after %d attempts: %s", payment_id, attempt, error)
+            _record(db, job_id, attempt, payment, error=error)
+            return
+        if _finish_job(db, job_id, attempt, status="queued", last_error=error,
+                       run_at=datetime.utcnow() + timedelta(seconds=_backoff(attempt))):
+            db.execute(
+                update(models.Payment).where(models.Payment.id == payment_id).values(error=error)
+            )
+            db.commit()
+        else:
+            db.rollback()
+    else:
+        _record(db, job_id, attempt, payment, reference=reference)
+
+def run_once() -> bool:
+    """Process one due job, if any; returns whether there was one."""
+    db = database.SessionLocal()
+    try:
+        job = claim(db)
+        if job is None:
+            return False
+        process(db, *job)
+        return True
+    finally:
+        db.close()
+
+def _worker_loop():
+    while not _stop.is_set():
+        try:
+            worked = run_once()
+        except Exception:
+            logger.exception("Payment worker error")
+            worked = False
+        if not worked:
+            _wake.wait(PAYMENT_POLL_INTERVAL)
+            _wake.clear()
+
+def start_workers(count: int = PAYMENT_WORKERS):
+    if _workers or count <= 0:
+        return
+    if payment_gateway is None:
+        logger.warning("PAYMENT_GATEWAY is not set; payment workers not started")
+        return
+    _stop.clear()
+    for n in range(count):
+        worker = threading.Thread(target=_worker_loop, name=f"payment-worker-{n}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+def stop_workers(timeout: float = 10):
+    # Jobs cut off mid-charge keep their lease and are retried once it expires.
+    _stop.set()
+    _wake.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+def worker_stats():
+    return {"workers": len(_workers), "max_attempts": PAYMENT_MAX_ATTEMPTS, "gateway": payment_gateway.name if payment_gateway else None}
@@ -0,0 +1,56 @@
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import json
+import compression, crud
+from cache import catalog_cache, etag_matches
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the standard library encoder
+    orjson = None
+
+# Response building for the catalog, shared by the sync and async handlers.
+
+def json_dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        return json_dumps(content)
+
+def product_dicts(products, fields: tuple = None) -> list:
+    # Products and rows come straight from the database, so they are dumped
+    # as-is rather than re-validated through schemas.Product.
+    names = fields or crud.PRODUCT_FIELDS
+    return [{field: getattr(p, field) for field in names} for p in products]
+
+def serialize_products(products, fields: tuple = None) -> bytes:
+    return json_dumps(product_dicts(products, fields))
+
+def cache_product_page(key, products, limit: int, sort: str, version: int, fields: tuple = None) -> dict:
+    next_cursor = crud.product_cursor(products[-1], sort) if products and len(products) == limit else None
+    return catalog_cache.set(key, serialize_products(products, fields), version, next_cursor=next_cursor)
+
+def catalog_response(entry: dict, if_none_match: str = None, accept_encoding: str = None):
+    body, etag = entry["body"], entry["etag"]
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    encoding = compression.choose_encoding(accept_encoding) if len(body) >= compression.COMPRESS_MIN_SIZE else None
+    if encoding:
+        # Compressed once per cached page and encoding, not once per request.
+        # Each encoding is a different representation, so it gets its own ETag.
+        if encoding not in entry:
+            entry[encoding] = compression.compress(body, encoding)
+        body, etag = entry[encoding], etag[:-1] + "-" + encoding + '"'
+        headers["Content-Encoding"] = encoding
+    headers["ETag"] = etag
+    if entry["next_cursor"]:
+        headers["X-Next-Cursor"] = entry["next_cursor"]
+    if etag_matches(if_none_match, etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
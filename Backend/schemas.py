@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+from datetime import date, datetime
 
 # User Schemas
 class UserBase(BaseModel):
@@ -23,8 +23,10 @@ class UserUpdate(BaseModel):
 
 class UserActivity(BaseModel):
     total_orders: int
+    total_spent: float = 0
+    first_order_date: Optional[datetime]
     last_order_date: Optional[datetime]
-    account_created: datetime
+    account_created: Optional[datetime]
 
 # Token Schemas
 class Token(BaseModel):
@@ -41,6 +43,8 @@ class ProductBase(BaseModel):
     description: str
     image: str
     category: str
+    sku: Optional[str] = None
+    stock: Optional[int] = Field(None, ge=0) # None: not tracked
 
 class ProductCreate(ProductBase):
     pass
@@ -51,10 +55,24 @@ class Product(ProductBase):
     class Config:
         orm_mode = True
 
+class ProductSearchResult(BaseModel):
+    items: List[Product]
+    total: int
+    facets: Dict[str, int]
+
+class ProductImportError(BaseModel):
+    row: int
+    error: str
+
+class ProductImportReport(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ProductImportError]
+
 # Order Schemas
 class OrderItemBase(BaseModel):
     product_id: int
-    quantity: int
+    quantity: int = Field(..., gt=0)
 
 class OrderCreate(BaseModel):
     items: List[OrderItemBase]
@@ -62,6 +80,8 @@ class OrderCreate(BaseModel):
 class OrderItem(OrderItemBase):
     id: int
     price: float
+    product_name: Optional[str] = None
+    product_image: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -77,8 +97,62 @@ class Order(BaseModel):
     class Config:
         orm_mode = True
 
+# Reservation Schemas
+class ReservationCreate(BaseModel):
+    product_id: int
+    quantity: int = Field(..., gt=0)
+
+class Reservation(ReservationCreate):
+    id: int
+    expires_at: datetime
+
+    class Config:
+        orm_mode = True
+
 # Payment Schema
 class PaymentCreate(BaseModel):
     order_id: int
     amount: float
     # In a real integration, we might receive a token from Stripe/PayPal
+
+class Payment(BaseModel):
+    id: int
+    order_id: int
+    amount: float
+    status: str
+    provider: str
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+# Analytics Schemas
+class CategorySales(BaseModel):
+    day: date
+    category: str
+    orders: int
+    units: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: Optional[str]
+    category: Optional[str]
+    orders: int
+    units: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
+
+class ProductSalesDay(BaseModel):
+    day: date
+    orders: int
+    units: int
+    revenue: float
+
+    class Config:
+        orm_mode = True
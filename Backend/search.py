@@ -0,0 +1,176 @@
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+import models
+
+# Product search over name, category and description.
+#
+# On Postgres the query runs against the ix_products_search GIN index. Other
+# databases (SQLite in development and tests) use ProductIndex, an in-process
+# inverted index meant for development only. crud.create_product and imports
+# keep it up to date in their own process, and every SEARCH_INDEX_REFRESH
+# seconds it picks up rows other processes inserted. Rows they changed in
+# place (an upsert by `manage.py import-products`) can only be noticed by a
+# full rebuild, which happens every SEARCH_INDEX_REBUILD seconds.
+
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+SEARCH_INDEX_REFRESH = float(os.getenv("SEARCH_INDEX_REFRESH", "5"))
+SEARCH_INDEX_REBUILD = float(os.getenv("SEARCH_INDEX_REBUILD", "300"))
+
+_token_re = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str):
+    return _token_re.findall(text.lower()) if text else []
+
+class ProductIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.postings = defaultdict(dict)  # token -> {product_id: weight}
+            self.products = {}  # product_id -> category
+            self.sorted_tokens = []
+            self.max_id = 0
+            self.built = False
+            self.built_at = 0.0
+            self.synced_at = 0.0
+
+    def add(self, product: models.Product):
+        with self._lock:
+            if product.id in self.products:
+                return
+            self.products[product.id] = product.category
+            self.max_id = max(self.max_id, product.id)
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(getattr(product, field)):
+                    if token not in self.postings:
+                        bisect.insort(self.sorted_tokens, token)
+                    postings = self.postings[token]
+                    postings[product.id] = postings.get(product.id, 0.0) + weight
+
+    def sync(self, db: Session, batch: int = 10000):
+        """Index rows with ids beyond the newest one seen (a full build the first time, and every SEARCH_INDEX_REBUILD seconds)."""
+        with self._lock:
+            if self.built and time.monotonic() - self.synced_at < SEARCH_INDEX_REFRESH:
+                return
+            if self.built and time.monotonic() - self.built_at >= SEARCH_INDEX_REBUILD:
+                self.reset()
+            if not self.built:
+                self.built_at = time.monotonic()
+            while True:
+                rows = (
+                    db.query(models.Product)
+                    .filter(models.Product.id > self.max_id)
+                    .order_by(models.Product.id)
+                    .limit(batch)
+                    .all()
+                )
+                for product in rows:
+                    self.add(product)
+                if len(rows) < batch:
+                    break
+            self.built = True
+            self.synced_at = time.monotonic()
+
+    def _matches(self, token: str, prefix: bool):
+        if not prefix:
+            return self.postings.get(token, {})
+        # Type-ahead: the last query term matches every indexed token it prefixes.
+        merged = {}
+        start = bisect.bisect_left(self.sorted_tokens, token)
+        for candidate in self.sorted_tokens[start:]:
+            if not candidate.startswith(token):
+                break
+            for product_id, weight in self.postings[candidate].items():
+                merged[product_id] = max(merged.get(product_id, 0.0), weight)
+        return merged
+
+    def search(self, query: str, category: str = None, limit: int = 20, offset: int = 0):
+        tokens = tokenize(query)
+        if not tokens:
+            return [], 0, {}
+        with self._lock:
+            total_docs = len(self.products) or 1
+            postings = [self._matches(t, prefix=(i == len(tokens) - 1)) for i, t in enumerate(tokens)]
+            postings.sort(key=len)
+            scores = {}
+            if postings[0]:
+                idfs = [math.log(1 + total_docs / len(p)) if p else 0.0 for p in postings]
+                for product_id in postings[0]:
+                    score = 0.0
+                    for posting, idf in zip(postings, idfs):
+                        weight = posting.get(product_id)
+                        if weight is None:
+                            break
+                        score += weight * idf
+                    else:
+                        scores[product_id] = score
+            facets = defaultdict(int)
+            for product_id in scores:
+                facets[self.products[product_id]] += 1
+            if category:
+                scores = {pid: s for pid, s in scores.items() if self.products[pid] == category}
+        # Only the requested page needs ordering, not every match.
+        top = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        page = [product_id for product_id, _ in top[offset:]]
+        return page, len(scores), dict(facets)
+
+product_index = ProductIndex()
+
+def _tsquery(tokens):
+    # tokenize() only yields \w runs, so the terms need no tsquery escaping.
+    if not tokens:
+        return None
+    return " & ".join(tokens[:-1] + [tokens[-1] + ":*"])
+
+def uses_index(db: Session) -> bool:
+    """False on Postgres, where searches run against ix_products_search instead of ProductIndex."""
+    return db.bind.dialect.name != "postgresql"
+
+def search_products(db: Session, query: str, category: str = None, limit: int = 20, offset: int = 0):
+    """Return (products, total, facets) for a search; facets ignore the category filter."""
+    if not uses_index(db):
+        return _search_postgres(db, query, category, limit, offset)
+    product_index.sync(db)
+    ids, total, facets = product_index.search(query, category, limit, offset)
+    if not ids:
+        return [], total, facets
+    by_id = {p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id], total, facets
+
+def _search_postgres(db: Session, query: str, category: str, limit: int, offset: int):
+    tsquery = _tsquery(tokenize(query))
+    if tsquery is None:
+        return [], 0, {}
+    vector = models.product_search_vector
+    ts = func.to_tsquery(literal_column("'simple'"), tsquery)
+    matches = vector.op("@@")(ts)
+
+    facets = dict(
+        db.query(models.Product.category, func.count(models.Product.id))
+        .filter(matches)
+        .group_by(models.Product.category)
+        .all()
+    )
+    results = db.query(models.Product).filter(matches)
+    if category:
+        results = results.filter(models.Product.category == category)
+        total = facets.get(category, 0)
+    else:
+        total = sum(facets.values())
+    products = (
+        results.order_by(func.ts_rank(vector, ts).desc(), models.Product.id)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return products, total, facets
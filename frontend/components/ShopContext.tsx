@@ -43,6 +43,25 @@ const ShopContext = createContext<ShopContextType | undefined>(undefined);
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// With read replicas, write responses carry X-Last-Write. Sending it back on
+// later reads makes the API serve them from the primary for a few seconds, so
+// the user sees their own changes.
+const rememberWrite = (response: Response) => {
+  const lastWrite = response.headers.get('X-Last-Write');
+  if (lastWrite) {
+    localStorage.setItem('lastWrite', lastWrite);
+  }
+};
+
+const authHeaders = (token: string | null): Record<string, string> => {
+  const headers: Record<string, string> = { 'Authorization': `Bearer ${token}` };
+  const lastWrite = localStorage.getItem('lastWrite');
+  if (lastWrite) {
+    headers['X-Last-Write'] = lastWrite;
+  }
+  return headers;
+};
+
 export function ShopProvider({ children }: { children: ReactNode }) {
   const [products, setProducts] = useState<Product[]>([]);
   const [cart, setCart] = useState<CartItem[]>([]);
@@ -57,7 +76,7 @@ export function ShopProvider({ children }: { children: ReactNode }) {
 
   const fetchProducts = async () => {
     try {
-      const response = await fetch(`${API_URL}/products?t=${new Date().getTime()}&limit=100`);
+      const response = await fetch(`${API_URL}/products?limit=100`);
       console.log('Fetch response status:', response.status);
       if (response.ok) {
         const data = await response.json();
@@ -140,6 +159,7 @@ export function ShopProvider({ children }: { children: ReactNode }) {
       });
 
       if (response.ok) {
+        rememberWrite(response);
         const data = await response.json();
         localStorage.setItem('token', data.access_token);
         setUser({ email, name });
@@ -154,6 +174,7 @@ export function ShopProvider({ children }: { children: ReactNode }) {
 
   const logout = () => {
     localStorage.removeItem('token');
+    localStorage.removeItem('lastWrite');
     setUser(null);
   };
 
@@ -178,6 +199,7 @@ export function ShopProvider({ children }: { children: ReactNode }) {
       });
 
       if (response.ok) {
+        rememberWrite(response);
         const updatedUser = await response.json();
         setUser({ email: updatedUser.email, name: updatedUser.name });
         return true;
@@ -190,29 +212,33 @@ export function ShopProvider({ children }: { children: ReactNode }) {
   };
 
   const fetchOrders = async () => {
+    // /orders/me is paginated: follow X-Next-Cursor until the last page.
+    const orders: any[] = [];
     try {
       const token = localStorage.getItem('token');
-      const response = await fetch(`${API_URL}/orders/me`, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        },
-      });
-      if (response.ok) {
-        return await response.json();
-      }
+      let cursor: string | null = null;
+      do {
+        const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        const response = await fetch(`${API_URL}/orders/me${query}`, {
+          headers: authHeaders(token),
+        });
+        if (!response.ok) {
+          break;
+        }
+        orders.push(...await response.json());
+        cursor = response.headers.get('X-Next-Cursor');
+      } while (cursor);
     } catch (error) {
       console.error('Fetch orders error:', error);
     }
-    return [];
+    return orders;
   };
 
   const fetchActivity = async () => {
     try {
       const token = localStorage.getItem('token');
       const response = await fetch(`${API_URL}/auth/me/activity`, {
-        headers: {
-          'Authorization': `Bearer ${token}`
-        },
+        headers: authHeaders(token),
       });
       if (response.ok) {
         return await response.json();